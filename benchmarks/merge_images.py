@@ -0,0 +1,82 @@
+"""
+Compares the old pixel-by-pixel frame variation of merge_images with vary_frame,
+on the team frame & icon assets the leaderboard downloads to DATA_PATH/tmp.
+
+Run the leaderboard at least once first so the assets are there, then from the repo root:
+    python -m benchmarks.merge_images [ASSETS_DIR]
+"""
+import os
+import sys
+import time
+import statistics
+from PIL import Image
+from config import DATA_PATH
+from bot.utils.io import vary_frame
+
+RUNS = 20
+
+
+def vary_frame_old(img: Image.Image) -> Image.Image:
+    """The frame variation step as merge_images used to do it."""
+    frame2 = img.copy()
+    pixels = frame2.load()
+    replaced = False
+    for i in range(frame2.size[0]):
+        for j in range(frame2.size[1]):
+            if pixels[i, j][3] == 255:
+                SQUARE_SIZE = 6
+                for x in range(SQUARE_SIZE):
+                    for y in range(SQUARE_SIZE):
+                        pixels[x, y] = pixels[i, j]
+                replaced = True
+                break
+        if replaced:
+            break
+    return frame2
+
+
+def load_merged_icons(assets_dir: str) -> list[Image.Image]:
+    """Merges every frame asset with every icon asset, like the team icon emotes are made."""
+    files = [f for f in os.listdir(assets_dir) if f.endswith(".png")]
+    frames = [f for f in files if "frame" in f.lower()]
+    icons = [f for f in files if "icon" in f.lower()]
+    merged = []
+    for frame_name in frames:
+        for icon_name in icons:
+            frame = Image.open(os.path.join(assets_dir, frame_name))
+            icon = Image.open(os.path.join(assets_dir, icon_name))
+            frame.paste(icon, (0, 0), icon)
+            merged.append(frame)
+    return merged
+
+
+def time_per_icon(vary, images: list[Image.Image]) -> float:
+    """Median time to vary every image once, divided by the number of images, in milliseconds."""
+    samples = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        for img in images:
+            vary(img)
+        samples.append((time.perf_counter() - start) * 1000 / len(images))
+    return statistics.median(samples)
+
+
+def main() -> None:
+    assets_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(DATA_PATH, "tmp")
+    images = load_merged_icons(assets_dir)
+    if len(images) == 0:
+        print(f"No frame & icon assets found in {assets_dir}")
+        return
+
+    for img in images:
+        assert vary_frame_old(img).tobytes() == vary_frame(img).tobytes(), "Outputs differ"
+
+    old_ms = time_per_icon(vary_frame_old, images)
+    new_ms = time_per_icon(vary_frame, images)
+    print(f"{len(images)} icons, {images[0].size[0]}x{images[0].size[1]}")
+    print(f"{'old (ms/icon)':>14} {'new (ms/icon)':>14} {'speedup':>8}")
+    print(f"{old_ms:>14.3f} {new_ms:>14.3f} {old_ms/new_ms:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
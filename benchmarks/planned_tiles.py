@@ -0,0 +1,194 @@
+"""
+Compares the old and current get_planned_tiles queries on synthetic planners,
+as the number of captures per tile grows.
+
+Needs a configured config.py and a Postgres user allowed to create schemas.
+Everything is created in a throwaway schema that's dropped at the end.
+Run from the repo root:
+    python -m benchmarks.planned_tiles
+"""
+import asyncio
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+import asyncpg
+import config
+import bot.utils.bloons
+from bot.db.queries.planner import get_planned_tiles
+
+SCHEMA = "bench_planned_tiles"
+PLANNERS = 20
+TRACKED_TILES = 30
+CLAIMS_PER_TILE = [1, 10, 50, 200, 1000]
+RUNS = 20
+
+# get_planned_tiles as it was before the rewrite
+OLD_QUERY = """
+    SELECT *
+    FROM (
+        SELECT c.tile, c.claimed_at, ptc.user_id, p.claims_channel, p.ping_role, p.ping_channel, p.planner_channel,
+            ptt.expires_after_hr, c.claimed_at + MAKE_INTERVAL(hours => ptt.expires_after_hr) AS expires_at
+        FROM (
+            claims c JOIN planners p ON c.channel = p.claims_channel
+            JOIN plannertrackedtiles ptt
+                ON ptt.planner_channel = p.planner_channel
+                    AND ptt.tile = c.tile
+            ) LEFT JOIN plannertileclaims ptc
+                ON p.planner_channel = ptc.planner_channel AND c.tile = ptc.tile
+        WHERE p.planner_channel = $3
+            AND c.claimed_at >= $1
+            AND c.tile = ANY($2::VARCHAR(3)[])
+        ORDER BY expires_at ASC
+    ) tcap
+    WHERE claimed_at = (
+        SELECT MAX(claimed_at)
+        FROM (
+            SELECT c.tile, c.claimed_at
+            FROM (
+                claims c JOIN planners p ON c.channel = p.claims_channel
+                JOIN plannertrackedtiles ptt
+                    ON ptt.planner_channel = p.planner_channel
+                        AND ptt.tile = c.tile
+                ) LEFT JOIN plannertileclaims ptc
+                    ON p.planner_channel = ptc.planner_channel AND c.tile = ptc.tile
+            WHERE p.planner_channel = $3
+                AND c.claimed_at >= $1
+                AND c.tile = ANY($2::VARCHAR(3)[])
+        ) tcap2
+        WHERE tcap.tile = tcap2.tile
+    ) AND (
+        (SELECT clear_time FROM planners WHERE planner_channel = $3) IS NULL
+        OR claimed_at >= (SELECT clear_time FROM planners WHERE planner_channel = $3)
+    )
+"""
+
+
+async def create_schema(conn: asyncpg.Connection) -> None:
+    await conn.execute(f"""
+        DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;
+        CREATE SCHEMA {SCHEMA};
+        SET search_path TO {SCHEMA};
+        CREATE TABLE claims (
+            userid BIGINT NOT NULL,
+            tile VARCHAR(3) NOT NULL,
+            channel BIGINT NOT NULL,
+            message BIGINT NOT NULL,
+            claimed_at TIMESTAMP,
+            called_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (message)
+        );
+        CREATE INDEX idx_claims_captured
+            ON claims (channel, tile, claimed_at)
+            WHERE claimed_at IS NOT NULL;
+        CREATE TABLE planners (
+            planner_channel BIGINT NOT NULL,
+            claims_channel BIGINT,
+            ping_role BIGINT,
+            ping_role_with_tickets BIGINT,
+            ping_channel BIGINT,
+            clear_time TIMESTAMP,
+            is_active BOOL DEFAULT TRUE,
+            PRIMARY KEY(planner_channel)
+        );
+        CREATE TABLE plannertileclaims (
+            user_id BIGINT NOT NULL,
+            planner_channel BIGINT NOT NULL,
+            tile VARCHAR(3),
+            claimed_at TIMESTAMP,
+            PRIMARY KEY(user_id, planner_channel, tile)
+        );
+        CREATE TABLE plannertrackedtiles (
+            tile VARCHAR(3) NOT NULL,
+            expires_after_hr INT NOT NULL,
+            registered_at TIMESTAMP NOT NULL,
+            planner_channel BIGINT NOT NULL,
+            PRIMARY KEY(tile, planner_channel)
+        );
+    """)
+
+
+def tile_code(i: int) -> str:
+    return f"{chr(ord('A') + i // 26)}{chr(ord('A') + i % 26)}A"
+
+
+async def populate(conn: asyncpg.Connection, claims_per_tile: int) -> None:
+    await conn.execute("TRUNCATE claims, planners, plannertileclaims, plannertrackedtiles")
+    event_start, _event_end = bot.utils.bloons.get_current_ct_period()
+    span = max((datetime.now() - event_start).total_seconds(), 3600)
+    now = datetime.now()
+
+    planners, tracked, reserved, claims = [], [], [], []
+    message = 0
+    for p in range(PLANNERS):
+        planner_channel, claims_channel = 1000+p, 2000+p
+        clear_time = event_start + timedelta(seconds=span/4) if p % 4 == 0 else None
+        planners.append((planner_channel, claims_channel, 3000+p, 4000+p, clear_time))
+        for t in range(TRACKED_TILES):
+            tile = tile_code(t)
+            tracked.append((tile, 24, now, planner_channel))
+            if t % 3 == 0:
+                reserved.append((5000+t, planner_channel, tile, now))
+            for _ in range(claims_per_tile):
+                message += 1
+                claimed_at = event_start + timedelta(seconds=random.uniform(0, span))
+                claims.append((6000+t, tile, claims_channel, message, claimed_at,
+                               claimed_at - timedelta(minutes=random.uniform(1, 30))))
+
+    await conn.copy_records_to_table(
+        "planners", records=planners,
+        columns=["planner_channel", "claims_channel", "ping_role", "ping_channel", "clear_time"],
+    )
+    await conn.copy_records_to_table("plannertrackedtiles", records=tracked)
+    await conn.copy_records_to_table("plannertileclaims", records=reserved)
+    await conn.copy_records_to_table("claims", records=claims)
+    await conn.execute("ANALYZE")
+
+
+async def time_query(run) -> float:
+    """Median latency of a query in milliseconds."""
+    samples = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        await run()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+async def main() -> None:
+    conn = await asyncpg.connect(
+        user=config.DB_USER, password=config.DB_PSWD,
+        database=config.DB_NAME, host=config.DB_HOST
+    )
+    try:
+        await create_schema(conn)
+        event_start, _event_end = bot.utils.bloons.get_current_ct_period()
+        tiles = [tile_code(t) for t in range(TRACKED_TILES)]
+
+        print(f"{'claims/tile':>12} {'old (ms)':>10} {'new (ms)':>10} {'speedup':>8}")
+        for claims_per_tile in CLAIMS_PER_TILE:
+            await populate(conn, claims_per_tile)
+
+            # Same planner rows out of both before timing anything
+            for p in range(PLANNERS):
+                old = await conn.fetch(OLD_QUERY, event_start, tiles, 1000+p)
+                new = await get_planned_tiles(1000+p, tiles, conn=conn)
+                assert sorted((r["tile"], r["claimed_at"]) for r in old) == \
+                       sorted((t.tile, t.claimed_at) for t in new), f"Results differ for planner {1000+p}"
+
+            old_ms = statistics.mean([
+                await time_query(lambda: conn.fetch(OLD_QUERY, event_start, tiles, 1000+p))
+                for p in range(PLANNERS)
+            ])
+            new_ms = statistics.mean([
+                await time_query(lambda: get_planned_tiles(1000+p, tiles, conn=conn))
+                for p in range(PLANNERS)
+            ])
+            print(f"{claims_per_tile:>12} {old_ms:>10.2f} {new_ms:>10.2f} {old_ms/new_ms:>7.1f}x")
+    finally:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -9,6 +9,7 @@ from config import DATA_PATH
 from datetime import datetime
 from discord.ext import commands
 from bot.utils.discordutils import handle_error
+from bot.db.BatchQueue import BatchQueue
 
 
 class CogBase(commands.Cog):
@@ -50,6 +51,7 @@ class CogBase(commands.Cog):
         await self._load_state()
 
     async def cog_unload(self) -> None:
+        await BatchQueue.flush_all()
         await self._save_state()
 
     @staticmethod
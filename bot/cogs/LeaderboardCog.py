@@ -1,5 +1,8 @@
+import io
 import math
 import os
+import time
+import random
 import aiofiles
 import re
 from typing import Any
@@ -8,9 +11,15 @@ from datetime import datetime, timedelta
 import discord
 from discord.ext import tasks, commands
 import asyncio
+import aiohttp
+import asyncpg
+import bloonspy.exceptions
 import bot.db.queries.leaderboard
 import bot.utils.io
 from bot.utils.bloonsdata import get_current_ct_event
+from bot.utils.AdaptiveLimiter import AdaptiveLimiter
+from bot.utils.IconCache import team_icon_cache
+from bot.utils.colors import purple, red
 from .CogBase import CogBase
 from config import EMOTE_GUILD_ID, DATA_PATH
 from bot.utils.emojis import (
@@ -39,10 +48,20 @@ class LeaderboardCog(CogBase):
         }
     }
 
+    EMOTE_SLOTS = 50  # For each of static and animated emotes
+    SEND_CONCURRENCY = 10
+    SEND_CONCURRENCY_PER_GUILD = 2
+    LOAD_CONCURRENCY_START = 5
+    LOAD_CONCURRENCY_MAX = 20
+    LOAD_ATTEMPTS = 4
+    LOAD_BACKOFF = 1  # Seconds before the first retry, doubled at each one after
+
     def __init__(self, bot: commands.Bot) -> None:
         super().__init__(bot)
 
         self.last_hour_score: dict[str, int] = {}
+        # When each team icon emote was last shown, by icon hash
+        self.icon_last_used: dict[str, float] = {}
         self.current_ct_id = ""
         self.first_run = True
         self.next_update = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
@@ -59,9 +78,12 @@ class LeaderboardCog(CogBase):
         return {
             "current_ct_id": self.current_ct_id,
             "last_hour_score": self.last_hour_score,
+            "icon_last_used": self.icon_last_used,
         }
 
     async def parse_state(self, saved_at: datetime, state: dict[str, Any]) -> None:
+        if "icon_last_used" in state:
+            self.icon_last_used = state["icon_last_used"]
         if self.next_update-saved_at > timedelta(hours=1):
             return
         if "current_ct_id" in state:
@@ -110,11 +132,6 @@ class LeaderboardCog(CogBase):
             pass
 
     async def do_leaderboard_update(self, now: datetime):
-        msg_header = ("Team                                                        |    Points\n"
-                      "—————————————————   +   —————") \
-                     if self.first_run else \
-                     ("Team                                                        |    Points      (Gained)\n"
-                      "—————————————————   +   ————————————")
         placements_emojis = {
             0: TOP_1_GLOBAL,
             1: TOP_2_GLOBAL,
@@ -144,12 +161,36 @@ class LeaderboardCog(CogBase):
         current_hour_score = {}
         for i in range(min(len(leaderboard), 100)):
             current_hour_score[leaderboard[i].id] = leaderboard[i].score
+
+        taken_at = now.replace(minute=0, second=0, microsecond=0)
+        if len(self.last_hour_score) == 0:
+            # The saved state was lost or too old, but last hour's snapshot has the same scores
+            previous = []
+            try:
+                previous = await bot.db.queries.leaderboard.get_leaderboard_snapshot(
+                    current_event.id, taken_at - timedelta(hours=1)
+                ) or []
+            except asyncpg.PostgresError as exc:
+                print(f"{purple('[Leaderboard]')} {red(f'Could not load the last leaderboard snapshot: {exc}')}")
+            if len(previous) > 0:
+                self.last_hour_score = {team.team_id: team.score for team in previous}
+                self.first_run = False
+        try:
+            await bot.db.queries.leaderboard.save_leaderboard_snapshot(
+                current_event.id,
+                taken_at,
+                [(team.id, team.score) for team in leaderboard],
+            )
+        except asyncpg.PostgresError as exc:
+            print(f"{purple('[Leaderboard]')} {red(f'Could not save the leaderboard snapshot: {exc}')}")
+
+        msg_header = ("Team                                                        |    Points\n"
+                      "—————————————————   +   —————") \
+                     if self.first_run else \
+                     ("Team                                                        |    Points      (Gained)\n"
+                      "—————————————————   +   ————————————")
         
-        # Load all teams 5 at a time
-        for i in range(math.ceil(len(leaderboard)/5)):
-            await asyncio.gather(*[
-                team.load_resource() for team in leaderboard[i*5:(i+1)*5]
-            ])
+        loaded_teams = await self.load_team_resources(leaderboard)
         
         # Load all team icon emotes if EMOTE_GUILD_ID is set
         team_icon_emotes = {}
@@ -159,7 +200,7 @@ class LeaderboardCog(CogBase):
                 emote_guild = await self.bot.fetch_guild(EMOTE_GUILD_ID)
             try:
                 team_icon_emotes = await asyncio.wait_for(
-                    self.load_team_icon_emotes(emote_guild, leaderboard),
+                    self.load_team_icon_emotes(emote_guild, [t for t in leaderboard[:100] if t.id in loaded_teams]),
                     timeout=7*60
                 )
             except TimeoutError:
@@ -175,7 +216,8 @@ class LeaderboardCog(CogBase):
                 placement = "❌"
 
             team_name = team.name.split("-")[0]
-            icon_hash = self.hash_team_icon(team)
+            # Teams that couldn't be loaded go without an icon
+            icon_hash = self.hash_team_icon(team) if team.id in loaded_teams else None
             message_full += "\n" + row_template.format(
                 placement=placement,
                 icon=f" {team_icon_emotes[icon_hash]}" if icon_hash in team_icon_emotes else "",
@@ -236,53 +278,125 @@ class LeaderboardCog(CogBase):
         await self.send_leaderboard(messages)
         self.first_run = False
     
+    @staticmethod
+    async def load_team_resources(teams: list["bloonspy.btd6.Team"]) -> set[str]:
+        """
+        Loads every team's resource, keeping as many requests in flight as the API allows.
+        Requests that fail because of rate limits or server errors are retried with exponential
+        backoff, teams that fail for any other reason or run out of attempts are skipped.
+        :return: The IDs of the teams that were loaded.
+        """
+        limiter = AdaptiveLimiter(
+            start=LeaderboardCog.LOAD_CONCURRENCY_START,
+            maximum=LeaderboardCog.LOAD_CONCURRENCY_MAX,
+        )
+        latencies = []
+        retries = 0
+        loaded = set()
+
+        async def load(team: "bloonspy.btd6.Team") -> None:
+            nonlocal retries
+            for attempt in range(LeaderboardCog.LOAD_ATTEMPTS):
+                async with limiter:
+                    start = time.perf_counter()
+                    try:
+                        await team.load_resource()
+                        latencies.append(time.perf_counter() - start)
+                        limiter.success()
+                        loaded.add(team.id)
+                        return
+                    except Exception as exc:
+                        if not LeaderboardCog.is_transient_error(exc):
+                            print(f"{purple('[Leaderboard]')} {red(f'Could not load team {team.id}: {exc!r}')}")
+                            return
+                        limiter.failure()
+                        if attempt == LeaderboardCog.LOAD_ATTEMPTS-1:
+                            print(f"{purple('[Leaderboard]')} "
+                                  f"{red(f'Gave up loading team {team.id} after {attempt+1} attempts: {exc!r}')}")
+                            return
+                retries += 1
+                await asyncio.sleep(LeaderboardCog.LOAD_BACKOFF * 2**attempt * random.uniform(1, 1.5))
+
+        load_start = time.perf_counter()
+        await asyncio.gather(*[load(team) for team in teams])
+        if len(latencies) > 0:
+            latencies.sort()
+            print(f"{purple('[Leaderboard]')} Loaded {len(loaded)}/{len(teams)} teams in "
+                  f"{time.perf_counter()-load_start:.1f}s "
+                  f"(p50 {latencies[len(latencies)//2]*1000:.0f}ms, "
+                  f"p95 {latencies[int(len(latencies)*0.95)]*1000:.0f}ms, "
+                  f"max {latencies[-1]*1000:.0f}ms, {retries} retries, ended at {limiter.limit} concurrent)")
+        return loaded
+
+    @staticmethod
+    def is_transient_error(exc: Exception) -> bool:
+        """Whether a failed API request is worth retrying: rate limits, server errors & network issues."""
+        if isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError)):
+            return True
+        if type(exc) is not bloonspy.exceptions.BloonsException:
+            return False
+        # bloonspy only tells these apart by their message. It raises "Request to ... failed"
+        # once it ran out of retries on the rate limit.
+        message = str(exc)
+        return message == "Server error occurred" or (message.startswith("Request to ") and message.endswith(" failed"))
+
     async def load_team_icon_emotes(self, emote_guild: discord.Guild, teams: list["bloonspy.btd6.Team"]) -> dict[str, str]:
+        now = datetime.now().timestamp()
+        guild_emojis = {e.name: e for e in emote_guild.emojis}
         emotes = {}
-        to_make = []
-        used = []
+        to_make = {}
         for team in teams:
             icon_hash = self.hash_team_icon(team)
-            if icon_hash in used:
+            if icon_hash in emotes or icon_hash in to_make:
                 continue
-            
-            found = False
-            for e in emote_guild.emojis:
-                if e.name == icon_hash:
-                    emotes[icon_hash] = f"<{'a' if e.animated else ''}:_:{e.id}>"
-                    found = True
-                    break
-            if not found:
-                to_make.append((team.frame, team.icon))
-            used.append(icon_hash)
-        
-        # Remove useless slots if any
-        avail_static_slots = 50
-        avail_anim_slots = 50
-        for e in emote_guild.emojis:
+            self.icon_last_used[icon_hash] = now
+            if (e := guild_emojis.get(icon_hash)) is not None:
+                emotes[icon_hash] = f"<{'a' if e.animated else ''}:_:{e.id}>"
+            else:
+                to_make[icon_hash] = (team.frame, team.icon)
+
+        avail_static_slots = LeaderboardCog.EMOTE_SLOTS
+        avail_anim_slots = LeaderboardCog.EMOTE_SLOTS
+        for e in guild_emojis.values():
             if e.animated:
                 avail_anim_slots -= 1
             else:
                 avail_static_slots -= 1
-        
-        for e in reversed(emote_guild.emojis):
+
+        # Free up the slots of the icons that went unused the longest
+        evictable = sorted(
+            (e for e in guild_emojis.values() if e.name not in emotes),
+            key=lambda e: self.icon_last_used.get(e.name, 0),
+        )
+        for e in evictable:
             if avail_static_slots + avail_anim_slots >= len(to_make):
                 break
-            if e.name not in used:
-                if e.animated:
-                    avail_anim_slots += 1
-                else:
-                    avail_static_slots += 1
-                await e.delete()
-
-        await self.download_team_icon_assets(to_make)
-        for frame, icon in to_make:
-            icon_hash = self.hash_team_icon(frame, icon)
-            emotes[icon_hash] = await self.make_team_icon_emote(emote_guild, icon_hash, frame, icon, avail_static_slots == 0)
-            if avail_static_slots > 0:
-                avail_static_slots -= 1
+            if e.animated:
+                avail_anim_slots += 1
             else:
-                avail_anim_slots -= 1
-        
+                avail_static_slots += 1
+            await e.delete()
+            self.icon_last_used.pop(e.name, None)
+
+        # Teams are sorted by placement, so if there's not enough room the lowest ones go without.
+        # Static slots are used up first.
+        to_make = [
+            (icon_hash, frame, icon, i >= avail_static_slots)
+            for i, (icon_hash, (frame, icon)) in enumerate(list(to_make.items())[:avail_static_slots + avail_anim_slots])
+        ]
+        await self.download_team_icon_assets([
+            (frame, icon) for icon_hash, frame, icon, animated in to_make
+            if team_icon_cache.get(icon_hash, animated) is None
+        ])
+        for icon_hash, frame, icon, animated in to_make:
+            emotes[icon_hash] = await self.make_team_icon_emote(emote_guild, icon_hash, frame, icon, animated)
+        await team_icon_cache.save()
+
+        # Only icons that still have an emote need to be remembered
+        self.icon_last_used = {
+            icon_hash: last_used for icon_hash, last_used in self.icon_last_used.items()
+            if icon_hash in guild_emojis or icon_hash in emotes
+        }
         return emotes
 
     @staticmethod
@@ -312,21 +426,34 @@ class LeaderboardCog(CogBase):
             icon: "bloonspy.btd6.Asset",
             animated: bool
     ) -> str:
-        tmp_path = os.path.join(DATA_PATH, "tmp")
-        frame_path = os.path.join(tmp_path, frame.name) + ".png"
-        icon_path = os.path.join(tmp_path, icon.name) + ".png"
-        if not os.path.exists(frame_path) or not os.path.exists(icon_path):
-            return BLANK
-        merged_path = os.path.join(tmp_path, f"{emote_name}.{'gif' if animated else 'png'}")
-        
-        success = await asyncio.to_thread(bot.utils.io.merge_images, frame_path, icon_path, merged_path, animated)
-        if not success:
-            os.remove(frame_path)
-            os.remove(icon_path)
-            return BLANK
+        image = None
+        if (merged_path := team_icon_cache.get(emote_name, animated)) is not None:
+            try:
+                async with aiofiles.open(merged_path, "rb") as fin:
+                    image = await fin.read()
+            except FileNotFoundError:
+                pass
+
+        if image is None:
+            tmp_path = os.path.join(DATA_PATH, "tmp")
+            frame_path = os.path.join(tmp_path, frame.name) + ".png"
+            icon_path = os.path.join(tmp_path, icon.name) + ".png"
+            if not os.path.exists(frame_path) or not os.path.exists(icon_path):
+                # It was cached when the assets were downloaded, but got evicted since
+                await LeaderboardCog.download_team_icon_assets([(frame, icon)])
+            if not os.path.exists(frame_path) or not os.path.exists(icon_path):
+                return BLANK
+            tmp_merged_path = os.path.join(tmp_path, f"{emote_name}.{'gif' if animated else 'png'}")
+
+            success = await asyncio.to_thread(bot.utils.io.merge_images, frame_path, icon_path, tmp_merged_path, animated)
+            if not success:
+                os.remove(frame_path)
+                os.remove(icon_path)
+                return BLANK
+            merged_path = await team_icon_cache.put(emote_name, animated, tmp_merged_path)
+            async with aiofiles.open(merged_path, "rb") as fin:
+                image = await fin.read()
 
-        async with aiofiles.open(merged_path, "rb") as fin:
-            image = await fin.read()
         # Be careful with this joint the rate limit is super low and
         # if you exceed it this function will be blocking for a whole hour.
         # If it's your first time running the leaderboard it WILL exceed it.
@@ -334,8 +461,6 @@ class LeaderboardCog(CogBase):
             emote = await emote_guild.create_custom_emoji(name=emote_name, image=image)
         except discord.errors.HTTPException:
             return BLANK
-        finally:
-            os.remove(merged_path)
 
         return f"<{'a' if animated else ''}:_:{emote.id}>"
     
@@ -347,35 +472,81 @@ class LeaderboardCog(CogBase):
 
     async def send_leaderboard(self, messages: list[str]) -> None:
         channels = await bot.db.queries.leaderboard.leaderboard_channels()
-        for leaderboard in channels:
-            guild_id, channel_id = leaderboard.guild_id, leaderboard.channel_id
-            guild = self.bot.get_guild(guild_id)
-            if guild is None:
-                try:
-                    guild = await self.bot.fetch_guild(guild_id)
-                except discord.NotFound:
-                    await bot.db.queries.leaderboard.remove_leaderboard_channel(guild_id, channel_id)
-                    continue
+        resolved = await asyncio.gather(*[
+            self.resolve_leaderboard_channel(lb.guild_id, lb.channel_id) for lb in channels
+        ], return_exceptions=True)
+        targets = []
+        for lb, channel in zip(channels, resolved):
+            if isinstance(channel, BaseException):
+                self.log_channel_error(lb.channel_id, channel)
+            elif channel is not None:
+                targets.append(channel)
 
-            channel = guild.get_channel(channel_id)
-            if channel is None:
+        global_limit = asyncio.Semaphore(LeaderboardCog.SEND_CONCURRENCY)
+        guild_limits = {channel.guild.id: asyncio.Semaphore(LeaderboardCog.SEND_CONCURRENCY_PER_GUILD)
+                        for channel in targets}
+        content = [(x, None) for x in messages]
+
+        async def send(channel: discord.TextChannel) -> None:
+            async with global_limit, guild_limits[channel.guild.id]:
+                start = time.perf_counter()
                 try:
-                    channel = await guild.fetch_channel(channel_id)
-                except discord.NotFound:
-                    await bot.db.queries.leaderboard.remove_leaderboard_channel(guild_id, channel_id)
-                    continue
+                    await bot.utils.discordutils.update_messages(
+                        self.bot.user,
+                        content,
+                        channel,
+                        tolerance=0
+                    )
+                except discord.Forbidden:
+                    return
+                except discord.HTTPException as exc:
+                    print(f"HTTPException in Leaderboard")
+                    traceback.print_exc()
+                    return
+                print(f"{purple('[Leaderboard]')} Updated #{channel.id} in {time.perf_counter()-start:.2f}s")
+
+        send_start = time.perf_counter()
+        results = await asyncio.gather(*[send(channel) for channel in targets], return_exceptions=True)
+        for channel, result in zip(targets, results):
+            if isinstance(result, BaseException):
+                self.log_channel_error(channel.id, result)
+        print(f"{purple('[Leaderboard]')} Sent to {len(targets)} channels in {time.perf_counter()-send_start:.2f}s")
+
+    async def resolve_leaderboard_channel(self, guild_id: int, channel_id: int) -> discord.TextChannel | None:
+        """
+        Gets a leaderboard channel, from cache if possible.
+        Channels that don't exist anymore are unsubscribed, ones that can't be fetched
+        right now are skipped.
+        """
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
             try:
-                await bot.utils.discordutils.update_messages(
-                    self.bot.user,
-                    [(x, None) for x in messages],
-                    channel,
-                    tolerance=0
-                )
-            except discord.Forbidden:
-                pass
+                guild = await self.bot.fetch_guild(guild_id)
+            except discord.NotFound:
+                await bot.db.queries.leaderboard.remove_leaderboard_channel(guild_id, channel_id)
+                return None
             except discord.HTTPException as exc:
-                print(f"HTTPException in Leaderboard")
-                traceback.print_exc()
+                self.log_channel_error(channel_id, exc)
+                return None
+
+        channel = guild.get_channel(channel_id)
+        if channel is None:
+            try:
+                channel = await guild.fetch_channel(channel_id)
+            except discord.NotFound:
+                await bot.db.queries.leaderboard.remove_leaderboard_channel(guild_id, channel_id)
+                return None
+            except discord.HTTPException as exc:
+                self.log_channel_error(channel_id, exc)
+                return None
+        return channel
+
+    @staticmethod
+    def log_channel_error(channel_id: int, exc: BaseException) -> None:
+        str_traceback = io.StringIO()
+        traceback.print_exception(exc, file=str_traceback)
+        print(f"{purple('[Leaderboard]')} {red(f'Could not update #{channel_id}')}\n"
+              f"{str_traceback.getvalue().rstrip()}")
 
 
 async def setup(bot: commands.Bot) -> None:
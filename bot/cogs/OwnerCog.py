@@ -43,6 +43,16 @@ class OwnerCog(commands.Cog):
                 msg += f"  - {'🟢' if tasks[cog_name][tname] else '🔴'} {tname}\n"
         await ctx.send(msg)
 
+    @commands.command()
+    @is_owner()
+    async def events(self, ctx: discord.ext.commands.Context) -> None:
+        msg = "**__Bot events:__**\n"
+        for event, stats in self.bot.events.stats.items():
+            msg += f"- **{event}:** {stats.dispatched} dispatched, " \
+                   f"avg {stats.avg_time*1000:.0f}ms, max {stats.max_time*1000:.0f}ms, " \
+                   f"{stats.errors} errors, {stats.slow} slow\n"
+        await ctx.send(msg)
+
     @commands.command()
     @is_owner()
     async def sync(self, ctx: discord.ext.commands.Context, where: None or [Literal["."]] = None) -> None:
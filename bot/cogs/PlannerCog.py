@@ -1,9 +1,11 @@
 from datetime import datetime, timedelta
 import re
+import time
 from typing import Any
 import discord
 from discord.ext import tasks, commands
 import asyncio
+import heapq
 import bot.db.model
 import bot.db.queries.planner
 import bot.db.queries.tickets
@@ -16,10 +18,12 @@ from bot.utils.bloons import (
 )
 from bot.utils.bloonsdata import (
     get_current_ct_event,
-    get_current_ct_tiles,
+    get_current_tile_index,
 )
+from bot.utils.MemberResolver import member_resolver
+from bot.utils.Debouncer import Debouncer
 from .CogBase import CogBase
-from bot.utils.emojis import TILE_BANNER, TILE_REGULAR, TILE_RELIC, RELICS
+from bot.utils.emojis import TILE_REGULAR
 from bot.views import PlannerUserView, PlannerAdminView
 from bot.utils.emojis import (
     EXPIRE_SUBOPTIMAL,
@@ -84,6 +88,9 @@ class PlannerCog(CogBase):
     }
     CHECK_EVERY = 30
     CHECK_EVERY_UNCLAIMED = 60
+    MAX_CONCURRENT_REMINDERS = 10
+    # Role edits share a tight per-guild rate limit, discord.py waits out any 429 on its own
+    MAX_CONCURRENT_ROLE_UPDATES = 5
 
     def __init__(self, dbot: commands.Bot) -> None:
         super().__init__(dbot)
@@ -94,8 +101,15 @@ class PlannerCog(CogBase):
         self.current_event: btd6.ContestedTerritoryEvent | None = None
         self.next_check = next_check
         self.next_check_unclaimed = next_check
-        self.banner_decays = []
+        # Min-heap of (expires_at, planner_channel, tile). Entries are invalidated lazily:
+        # one only counts if it matches what's in decay_deadlines.
+        self.decay_heap: list[tuple[datetime, int, str]] = []
+        self.decay_deadlines: dict[tuple[int, str], datetime] = {}
+        self.decay_schedule_changed = asyncio.Event()
+        # Caps how many reminders are sent at once, so a big sweep doesn't trip the rate limits
+        self.reminder_semaphore = asyncio.Semaphore(PlannerCog.MAX_CONCURRENT_REMINDERS)
         self.next_planner_refreshes = {}
+        self.planner_renders = Debouncer(self.render_planner_msg)
         self.last_check_end = self.next_check
         self.ct_day = get_current_ct_day()
 
@@ -115,16 +129,22 @@ class PlannerCog(CogBase):
         }
 
     async def cog_load(self) -> None:
+        load_start = time.perf_counter()
         await super().cog_load()
 
         self.current_event = await get_current_ct_event()
 
+        views_start = time.perf_counter()
         views = await self.get_views()
         for v in views:
             self.bot.add_view(v)
+        planner_logger.info(f"Registered {len(views)} planner views in {time.perf_counter()-views_start:.2f}s")
         self.check_reminders.start()
 
-        self.banner_decays = await qplanner.get_tile_closest_to_expire(datetime.now())
+        all_planned_tiles = await qplanner.get_all_planned_tiles()
+        for planner in await qplanner.get_planners():
+            await self.schedule_decays(planner.planner_channel,
+                                       planned_tiles=all_planned_tiles.get(planner.planner_channel, []))
         self.check_decay.start()
 
         next_refresh = datetime.now().replace(second=0, microsecond=0, minute=0) + timedelta(hours=1)
@@ -136,6 +156,12 @@ class PlannerCog(CogBase):
         self.check_reset.start()
         self.check_orphan_has_tickets_roles.start()
 
+        self.bot.events.subscribe("on_tile_started", self.on_tile_started)
+        # Role updates can take a while under rate limits, that's not worth reporting
+        self.bot.events.subscribe("on_tile_captured", self.on_tile_captured, timeout=None)
+        self.bot.events.subscribe("on_tile_uncaptured", self.on_tile_uncaptured, timeout=None)
+        planner_logger.info(f"Loaded in {time.perf_counter()-load_start:.2f}s")
+
     async def cog_unload(self) -> None:
         await super().cog_unload()
         self.check_reminders.cancel()
@@ -143,6 +169,9 @@ class PlannerCog(CogBase):
         self.check_planner_refresh.cancel()
         self.check_reset.cancel()
         self.check_orphan_has_tickets_roles.cancel()
+        self.bot.events.unsubscribe("on_tile_started", self.on_tile_started)
+        self.bot.events.unsubscribe("on_tile_captured", self.on_tile_captured)
+        self.bot.events.unsubscribe("on_tile_uncaptured", self.on_tile_uncaptured)
 
     @tasks.loop(seconds=10)
     async def check_reminders(self) -> None:
@@ -167,63 +196,73 @@ class PlannerCog(CogBase):
             check_unclaimed = True
             self.next_check_unclaimed += timedelta(minutes=PlannerCog.CHECK_EVERY_UNCLAIMED)
 
-        _cts, ct_end = get_current_ct_period()
-        planners = await qplanner.get_planners(only_active=True)
-        for planner in planners:
-            tile_codes = await qplanner.get_planner_tracked_tiles(planner.planner_channel)
-            pings = await self.check_planner_reminder(
-                planner.planner_channel,
-                planner.ping_channel,
-                tile_codes,
-                check_from,
-                min(check_to, ct_end-timedelta(hours=12)),
-                check_to_unclaimed if check_unclaimed else None
-            )
-            if len(pings.keys()) > 0:
-                await self.send_reminder(
-                    pings,
-                    planner.planner_channel,
-                    planner.ping_channel,
-                    planner.ping_role_with_tickets if planner.ping_role_with_tickets else planner.team_role,
+        check_to = min(check_to, ct_end-timedelta(hours=12))
+        expiring = await qplanner.get_expiring_tiles(
+            check_from,
+            check_to,
+            check_to_unclaimed if check_unclaimed else None,
+        )
+        if len(expiring) > 0:
+            planners = {p.planner_channel: p for p in await qplanner.get_planners(only_active=True)}
+            reminders = []
+            for planner_id in expiring:
+                planner = planners.get(planner_id)
+                if planner is None:
+                    continue
+                pings = self.get_reminder_pings(
+                    expiring[planner_id],
+                    check_to,
+                    check_to_unclaimed if check_unclaimed else None,
                 )
+                if len(pings.keys()) > 0:
+                    reminders.append(self.send_reminder_bounded(
+                        pings,
+                        planner.planner_channel,
+                        planner.ping_channel,
+                        planner.ping_role_with_tickets if planner.ping_role_with_tickets else planner.team_role,
+                    ))
+            await asyncio.gather(*reminders)
         await self._save_state()
 
-    async def check_planner_reminder(
-            self,
-            planner_id: int,
-            ping_ch_id: int,
-            banner_codes: list[str],
-            check_from: datetime,
+    @staticmethod
+    def get_reminder_pings(
+            banners: list[bot.db.model.PlannedTile.PlannedTile],
             check_to: datetime,
             check_to_unclaimed: datetime or None
     ) -> dict[int or None, list[str]]:
-        if ping_ch_id is None:
-            return {}
-        banners = await qplanner.get_planned_tiles(planner_id, banner_codes,
-                                                                 expire_between=(check_from, check_to))
-        banners_unclaimed = []
-        if check_to_unclaimed is not None:
-            banners_unclaimed = await qplanner.get_planned_tiles(planner_id, banner_codes,
-                                                                               expire_between=(check_from,
-                                                                                               check_to_unclaimed),
-                                                                               claimed_status="UNCLAIMED")
-        if len(banners) == 0 and len(banners_unclaimed) == 0:
-            return {}
-
+        """
+        Groups a planner's expiring tiles by who should be pinged for them.
+        :param banners: The planner's tiles, sorted by expire time.
+        :param check_to: Tiles expiring before this are pinged to whoever claimed them.
+        :param check_to_unclaimed: Unclaimed tiles expiring before this are pinged to the team.
+        :return: The tiles for each member. Tiles for the team role are under the None key.
+        """
         pings = {}
         for b in banners:
+            if b.expires_at >= check_to:
+                continue
             if b.claimed_by not in pings:
                 pings[b.claimed_by] = []
             pings[b.claimed_by].append(b.tile)
 
-        for unclaimed_b in banners_unclaimed:
-            if None not in pings:
-                pings[None] = []
-            if unclaimed_b.tile not in pings[None]:
-                pings[None].append(unclaimed_b.tile)
+        if check_to_unclaimed is not None:
+            for unclaimed_b in banners:
+                if unclaimed_b.claimed_by is not None or unclaimed_b.expires_at >= check_to_unclaimed:
+                    continue
+                if None not in pings:
+                    pings[None] = []
+                if unclaimed_b.tile not in pings[None]:
+                    pings[None].append(unclaimed_b.tile)
 
         return pings
 
+    async def send_reminder_bounded(self, *args, **kwargs) -> None:
+        async with self.reminder_semaphore:
+            try:
+                await self.send_reminder(*args, **kwargs)
+            except Exception as exc:
+                planner_logger.error(f"Couldn't send reminder: {exc}")
+
     async def send_reminder(
             self,
             pings: dict[int or None, list[str]],
@@ -277,58 +316,94 @@ class PlannerCog(CogBase):
         except discord.Forbidden:
             await qplanner.planner_delete_config(planner_id, ping_ch=True)
 
-    @tasks.loop(seconds=5)
+    async def schedule_decays(self,
+                              planner_id: int,
+                              tiles: list[str] | None = None,
+                              planned_tiles: list[bot.db.model.PlannedTile.PlannedTile] | None = None) -> None:
+        """
+        (Re)schedules the decay of a planner's tiles.
+        :param planner_id: The ID of the planner.
+        :param tiles: The tiles that changed. If None, reschedules all of the planner's tiles.
+        :param planned_tiles: The planner's tiles, if they were already fetched.
+        """
+        self.unschedule_decays(planner_id, tiles)
+        if planned_tiles is None:
+            if tiles is None:
+                tiles = await qplanner.get_planner_tracked_tiles(planner_id)
+            planned_tiles = await qplanner.get_planned_tiles(planner_id, tiles)
+
+        now = datetime.now()
+        for planned in planned_tiles:
+            if planned.expires_at <= now:
+                continue
+            self.decay_deadlines[(planner_id, planned.tile)] = planned.expires_at
+            heapq.heappush(self.decay_heap, (planned.expires_at, planner_id, planned.tile))
+        self.decay_schedule_changed.set()
+
+    def unschedule_decays(self, planner_id: int, tiles: list[str] | None = None) -> None:
+        """Stops tracking the decay of a planner's tiles, or all of them if `tiles` is None."""
+        if tiles is None:
+            tiles = [tile for pid, tile in self.decay_deadlines if pid == planner_id]
+        for tile in tiles:
+            self.decay_deadlines.pop((planner_id, tile), None)
+
+    @tasks.loop(seconds=0)
     async def check_decay(self) -> None:
         """
-        Checks if a banner has just decayed and pings the team in the appropriate channel.
+        Sleeps until the next tracked tile decays and pings the team in the appropriate channel.
+        Wakes up early whenever the schedule changes.
         """
+        self.decay_schedule_changed.clear()
+        timeout = None
+        if len(self.decay_heap) > 0:
+            timeout = max((self.decay_heap[0][0] - datetime.now()).total_seconds(), 0)
+        try:
+            await asyncio.wait_for(self.decay_schedule_changed.wait(), timeout)
+            return
+        except asyncio.TimeoutError:
+            pass
+
         now = datetime.now()
+        decayed: dict[int, list[str]] = {}
+        while len(self.decay_heap) > 0 and self.decay_heap[0][0] <= now:
+            expires_at, planner_id, tile = heapq.heappop(self.decay_heap)
+            if self.decay_deadlines.get((planner_id, tile)) != expires_at:
+                continue
+            del self.decay_deadlines[(planner_id, tile)]
+            if planner_id not in decayed:
+                decayed[planner_id] = []
+            decayed[planner_id].append(tile)
+
         _cts, ct_end = get_current_ct_period()
         if now >= ct_end-timedelta(hours=12):
             return
 
-        update_expire_list = False
         send_ping_coros = []
-        for banner in self.banner_decays:
-            tile_expire_time = banner.claimed_at + timedelta(hours=banner.expires_in_hr)
-            if tile_expire_time < now:
-                update_expire_list = True
-                planner = await qplanner.get_planner(banner.planner_channel)
-                if not planner.is_active:
-                    continue
-
-                tiles_tracked = await qplanner.get_planner_tracked_tiles(planner.planner_channel)
-                tiles_expiring = await qplanner.get_planned_tiles(
-                    planner.planner_channel,
-                    tiles_tracked,
-                    expire_between=(tile_expire_time, now),
-                )
-                for exp_tile in tiles_expiring:
-                    send_ping_coros.append(
-                        self.decay_ping_when_ready(exp_tile, planner)
-                    )
-
+        for planner_id in decayed:
+            planner = await qplanner.get_planner(planner_id)
+            if planner is None or not planner.is_active:
+                continue
+            for tile in decayed[planner_id]:
+                send_ping_coros.append(self.decay_ping_when_ready(tile, planner))
         await asyncio.gather(*send_ping_coros)
-        if update_expire_list:
-            self.banner_decays = await qplanner.get_tile_closest_to_expire(now)
 
     async def decay_ping_when_ready(self,
-                                    tile: "bot.db.model.PlannedTile.PlannedTile",
+                                    tile: str,
                                     planner: "bot.db.model.Planner.Planner") -> None:
-        # now = datetime.now()
-        tile_data = await qplanner.planner_get_tile_status(tile.tile, tile.planner_channel)
+        tile_data = await qplanner.planner_get_tile_status(tile, planner.planner_channel)
+        if tile_data is None:
+            return
+        if tile_data.expires_at > datetime.now():
+            # Recaptured since it was scheduled, track its new expire time instead
+            await self.schedule_decays(planner.planner_channel, [tile], [tile_data])
+            return
         ping_role = planner.ping_role_with_tickets if planner.ping_role_with_tickets else planner.ping_role
 
-        # This check never happens when called by check_decay since it only
-        # fetches tiles whose expires_at is strictly lower than now.
-        # if now < tile_data.expires_at:
-        #     await asyncio.sleep((tile_data.expires_at-now).total_seconds())
-
         if tile_data.ping_channel is not None:
             await self.send_decay_ping(
-                tile.planner_channel,
+                planner.planner_channel,
                 tile_data.ping_channel,
-                tile.tile,
+                tile,
                 tile_data.claimed_by,
                 ping_role,
             )
@@ -368,10 +443,11 @@ class PlannerCog(CogBase):
         if now > self.current_event.end + timedelta(hours=1) or now < self.current_event.start:
             return
 
-        for planner_channel in self.next_planner_refreshes:
-            if self.next_planner_refreshes[planner_channel] > now:
-                continue
-            await self.send_planner_msg(planner_channel)
+        await asyncio.gather(*[
+            self.send_planner_msg(planner_channel)
+            for planner_channel in self.next_planner_refreshes
+            if self.next_planner_refreshes[planner_channel] <= now
+        ])
 
     @tasks.loop(seconds=60)
     async def check_reset(self) -> None:
@@ -415,6 +491,7 @@ class PlannerCog(CogBase):
             await qplanner.overwrite_planner_tiles(
                 p.planner_channel, [(tile, 24) for tile in banners]
             )
+            await self.schedule_decays(p.planner_channel)
 
     async def reassign_has_tickets_roles(self) -> None:
         """
@@ -438,10 +515,7 @@ class PlannerCog(CogBase):
                 if role is None:
                     continue
 
-            checks = []
-            for member in role.members:
-                checks.append(self.check_has_tickets_role(member, pln))
-            await asyncio.gather(*checks)
+            await self.reconcile_has_tickets_role(role.members, pln)
 
     async def remove_has_tickets_roles(self) -> None:
         """Removes the has tickets role from all planners."""
@@ -490,6 +564,7 @@ class PlannerCog(CogBase):
             return
 
         await qplanner.del_planner(channel.id)
+        self.unschedule_decays(channel.id)
         await interaction.response.send_message(
             content=f"<#{channel.id}> will no longer be updated as a planner!",
             ephemeral=True
@@ -558,6 +633,8 @@ class PlannerCog(CogBase):
             ping_role=ping_role.id if ping_role else None,
             tile_claim_ch=tile_claim_channel.id if tile_claim_channel else None,
         )
+        if tile_claim_channel:
+            await self.schedule_decays(planner_channel.id)
         await interaction.response.send_message(
             content="All done! Check the planner's control panel!",
             ephemeral=True
@@ -598,6 +675,7 @@ class PlannerCog(CogBase):
             planner_channel.id,
             [(tile, 24) for tile in tile_list]
         )
+        await self.schedule_decays(planner_channel.id)
 
         await interaction.response.send_message(
             content="All done! The planner message will be updated in a bit...",
@@ -656,6 +734,7 @@ class PlannerCog(CogBase):
                 ping_role_msg
             ), PlannerAdminView(channel,
                                 self.send_planner_msg,
+                                self.schedule_decays,
                                 self.edit_tile_time,
                                 self.force_unclaim,
                                 self.add_planner_tile,
@@ -666,9 +745,7 @@ class PlannerCog(CogBase):
 
         now = datetime.now()
         tile_table = PLANNER_TABLE_HEADER
-        banner_codes = await self.get_banner_tile_list()
-        relic_tiles = await self.get_relic_tile_list()
-        relic_codes = [r.id for r in relic_tiles]
+        tile_index = await get_current_tile_index()
         tile_list = await qplanner.get_planner_tracked_tiles(channel)
         ct_start, ct_end = get_current_ct_period()
         if now < ct_end:
@@ -689,7 +766,7 @@ class PlannerCog(CogBase):
             if expire_at >= ct_end-timedelta(hours=12):
                 hours_left = (ct_end - now).total_seconds() // 3600
                 banners_hours_left = (ct_end - expire_at).total_seconds() // 3600
-                if tile.tile in banner_codes and (hours_left+1) * 20 < (banners_hours_left+1) * 40:
+                if tile.tile in tile_index.banners and (hours_left+1) * 20 < (banners_hours_left+1) * 40:
                     emoji_claim = EXPIRE_SUBOPTIMAL
                     emojis_explanations[EXPIRE_SUBOPTIMAL] = "If you have any tickets left, " \
                                                              "it's more optimal to take than a regular tile"
@@ -706,15 +783,7 @@ class PlannerCog(CogBase):
             elif expire_at-now < timedelta(hours=3):
                 emoji_claim = EXPIRE_3HR
 
-            emoji_tile = TILE_REGULAR
-            if tile.tile in banner_codes:
-                emoji_tile = TILE_BANNER
-            elif tile.tile in relic_codes:
-                r_idx = relic_codes.index(tile.tile)
-                emoji_tile = TILE_RELIC
-                relic = relic_tiles[r_idx]
-                if relic.relic in RELICS.keys():
-                    emoji_tile = RELICS[relic.relic]
+            emoji_tile = tile_index.emojis.get(tile.tile, TILE_REGULAR)
             row_second_part = PLANNER_TABLE_ROW_STALE if emoji_claim == EXPIRE_STALE else PLANNER_TABLE_ROW_TIME
             new_row = PLANNER_TABLE_ROW.format(
                 emoji_claim=emoji_claim,
@@ -760,10 +829,12 @@ class PlannerCog(CogBase):
     async def get_views(self) -> list[None or PlannerUserView]:
         views = []
         channels = await qplanner.get_planners()
+        all_tile_codes = await qplanner.get_all_tracked_tiles()
+        all_tiles = await qplanner.get_all_planned_tiles()
         for channel in channels:
             channel_id = channel.planner_channel
-            tile_codes = await qplanner.get_planner_tracked_tiles(channel_id)
-            tiles = await qplanner.get_planned_tiles(channel_id, tile_codes)
+            tile_codes = all_tile_codes.get(channel_id, [])
+            tiles = all_tiles.get(channel_id, [])
             banner_claims = {}
             for banner in tile_codes:
                 banner_claims[banner] = False
@@ -778,6 +849,7 @@ class PlannerCog(CogBase):
             views.append(
                 PlannerAdminView(channel_id,
                                  self.send_planner_msg,
+                                 self.schedule_decays,
                                  self.edit_tile_time,
                                  self.force_unclaim,
                                  self.add_planner_tile,
@@ -787,27 +859,15 @@ class PlannerCog(CogBase):
 
         return views
 
-    @staticmethod
-    async def get_banner_tile_list() -> list[str]:
-        """Returns a list of banner tile codes."""
-        return [
-            tile.id for tile in await get_current_ct_tiles()
-            if tile.tile_type == btd6.CtTileType.BANNER
-        ]
-
-    @staticmethod
-    async def get_relic_tile_list() -> list[btd6.CtTile]:
-        """Returns a list of relic tiles."""
-        return [
-            r for r in await get_current_ct_tiles()
-            if r.tile_type == btd6.CtTileType.RELIC
-        ]
-
     async def send_planner_msg(self, channel_id: int) -> None:
-        """(Re)sends the planner message.
+        """(Re)sends the planner message. Requests for the same planner made close together
+        are coalesced into a single render.
 
         :param channel_id: The ID of the Planner channel.
         """
+        await self.planner_renders(channel_id)
+
+    async def render_planner_msg(self, channel_id: int) -> None:
         channel = self.bot.get_channel(channel_id)
         if channel is None:
             try:
@@ -943,15 +1003,14 @@ class PlannerCog(CogBase):
                 pass
         else:
             channel = self.bot.get_channel(claim_channel)
-            member = channel.guild.get_member(claimer)
-            if member is None:
-                member = await channel.guild.fetch_member(claimer)
-            await self.check_has_tickets_role(member, planner)
+            member = await member_resolver.get_member(channel.guild, claimer)
+            if member is not None:
+                await self.check_has_tickets_role(member, planner)
 
         # Update planner if necessary
         tile_list = await qplanner.get_planner_tracked_tiles(planner_id)
         if tile in tile_list:
-            self.banner_decays = await qplanner.get_tile_closest_to_expire(datetime.now())
+            await self.schedule_decays(planner_id, [tile])
             await self.send_planner_msg(planner_id)
 
     async def edit_tile_time(self,
@@ -993,9 +1052,10 @@ class PlannerCog(CogBase):
 
         tile_status = await qplanner.planner_get_tile_status(tile, planner_id)
         if tile_status and tile_status.claimed_by:
-            member = interaction.guild.get_member(tile_status.claimed_by)
-            await self.check_has_tickets_role(member, planner_info)
-        self.banner_decays = await qplanner.get_tile_closest_to_expire(datetime.now())
+            member = await member_resolver.get_member(interaction.guild, tile_status.claimed_by)
+            if member is not None:
+                await self.check_has_tickets_role(member, planner_info)
+        await self.schedule_decays(planner_id, [tile])
 
     async def force_unclaim(self, interaction: discord.Interaction, planner_id: int, tile: str) -> None:
         prev_status = await qplanner.planner_get_tile_status(tile, planner_id)
@@ -1008,7 +1068,9 @@ class PlannerCog(CogBase):
 
         if prev_status.claimed_by is None:
             return
-        member = interaction.guild.get_member(prev_status.claimed_by)
+        member = await member_resolver.get_member(interaction.guild, prev_status.claimed_by)
+        if member is None:
+            return
         planner = await qplanner.get_planner(planner_id)
         await self.check_has_tickets_role(member, planner)
 
@@ -1020,7 +1082,7 @@ class PlannerCog(CogBase):
                     f"*Need to remove lots of tiles? Try using </planner overwrite:{overwrite_id}> instead!*",
             ephemeral=True
         )
-        self.banner_decays = await qplanner.get_tile_closest_to_expire(datetime.now())
+        self.unschedule_decays(planner_id, [tile])
         await self.send_planner_msg(planner_id)
 
     async def add_planner_tile(self,
@@ -1036,7 +1098,7 @@ class PlannerCog(CogBase):
                     f"*Need to add lots of tiles? Try using </planner overwrite:{overwrite_id}> instead!*",
             ephemeral=True
         )
-        self.banner_decays = await qplanner.get_tile_closest_to_expire(datetime.now())
+        await self.schedule_decays(planner_id, [tile])
         await self.send_planner_msg(planner_id)
 
     async def create_ping_role(self, planner: bot.db.model.Planner.Planner) -> discord.Role or None:
@@ -1064,10 +1126,7 @@ class PlannerCog(CogBase):
         if not planner.claims_channel:
             return ret
 
-        checks = []
-        for member in team_role.members:
-            checks.append(self.check_has_tickets_role(member, planner))
-        await asyncio.gather(*checks)
+        await self.reconcile_has_tickets_role(team_role.members, planner)
 
         return ret
 
@@ -1078,35 +1137,50 @@ class PlannerCog(CogBase):
         :param member: The member to check.
         :param planner: The planner to check for.
         """
-        if planner.ping_role_with_tickets is None:
+        await PlannerCog.reconcile_has_tickets_role([member], planner)
+
+    @staticmethod
+    async def reconcile_has_tickets_role(members: list[discord.Member], planner: bot.db.model.Planner.Planner) -> None:
+        """
+        Adds the "has tickets" role to the members who have tickets left today and removes it
+        from those who don't. Only members whose role is wrong are touched.
+        :param members: The members to check, all from the planner's guild.
+        :param planner: The planner to check for.
+        """
+        if planner.ping_role_with_tickets is None or len(members) == 0:
             return
-        ping_role = member.guild.get_role(planner.ping_role_with_tickets)
+        ping_role = members[0].guild.get_role(planner.ping_role_with_tickets)
         if ping_role is None:
             await qplanner.planner_delete_config(planner.planner_channel, ping_role_with_tickets=True)
             return
 
-        today_ticket_idx = min(get_current_ct_day() - 1, 6)
-        tickets_used = len(
-            (await bot.db.queries.tickets.get_tickets_from(member.id, planner.claims_channel))[today_ticket_idx]
-        )
-
-        member_claims = await qplanner.get_claims_by(member.id, planner.planner_channel)
-        tile_codes = [claim["tile"] for claim in member_claims]
-        tile_infos = await qplanner.get_planned_tiles(planner.planner_channel, tile_codes)
-        today = get_current_ct_day()
-        for ti in tile_infos:
-            expire_in_day = get_ct_day_during(ti.claimed_at + timedelta(hours=ti.expires_in_hr))
-            if expire_in_day == today:
-                tickets_used += 1
-
-        has_role = discord.utils.get(member.roles, id=planner.ping_role_with_tickets) is not None
-        try:
-            if has_role and tickets_used >= 4:
-                await member.remove_roles(ping_role)
-            elif not has_role and tickets_used < 4:
-                await member.add_roles(ping_role)
-        except discord.Forbidden:
-            pass
+        tickets_used = await qplanner.get_tickets_used_today(planner.planner_channel)
+        to_add = []
+        to_remove = []
+        for member in members:
+            has_role = discord.utils.get(member.roles, id=planner.ping_role_with_tickets) is not None
+            has_tickets = tickets_used.get(member.id, 0) < 4
+            if has_role and not has_tickets:
+                to_remove.append(member)
+            elif not has_role and has_tickets:
+                to_add.append(member)
+
+        semaphore = asyncio.Semaphore(PlannerCog.MAX_CONCURRENT_ROLE_UPDATES)
+
+        async def update_role(member: discord.Member, add: bool) -> None:
+            async with semaphore:
+                try:
+                    if add:
+                        await member.add_roles(ping_role)
+                    else:
+                        await member.remove_roles(ping_role)
+                except discord.Forbidden:
+                    pass
+                except discord.HTTPException as exc:
+                    planner_logger.error(f"Couldn't update the tickets role of {member.id}: {exc}")
+
+        await asyncio.gather(*[update_role(m, True) for m in to_add],
+                             *[update_role(m, False) for m in to_remove])
 
 
 async def setup(bot: commands.Bot) -> None:
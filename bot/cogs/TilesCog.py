@@ -18,7 +18,7 @@ from .CogBase import CogBase
 from datetime import datetime, timedelta
 from typing import Literal
 from bot.views.SpawnlockPaginate import SpawnlockPaginateView
-from bot.utils.ctmap import make_map
+from bot.utils.ctmap import make_map, load_tile_overlays
 
 TeamColor = Literal["Purple", "Red", "Yellow", "Pink", "Blue", "Green"]
 spawn_tile_codes = {
@@ -51,6 +51,11 @@ class TilesCog(CogBase):
         super().__init__(bot)
         self.regs = Cache(None, datetime.now())
 
+    async def cog_load(self) -> None:
+        await super().cog_load()
+        # Decodes & resizes the map overlays now rather than on the first /ctmap
+        await asyncio.to_thread(load_tile_overlays)
+
     @discord.app_commands.command(name="tile",
                                   description="Check a tile's challenge data")
     @discord.app_commands.describe(tile="The 3 letter tile code, or a relic name.",
@@ -1,13 +1,20 @@
+import io
 import asyncio
 import datetime
+import traceback
 import discord
 from discord.ext import commands, tasks
 import re
+from typing import Any
+import asyncpg
 import bot.db.queries.tickets
-from bot.utils.bloons import get_ct_number_during
+from bot.utils.bloons import get_ct_number_during, get_ct_period_during
 from bot.utils.bloonsdata import is_tile_code_valid
+from bot.utils.RecentMessageCache import RecentMessageCache, CachedMessage
+from bot.utils.MemberResolver import member_resolver
 from .CogBase import CogBase
 from bot.utils.emojis import WARN_ALREADY_CLAIMED
+from bot.utils.colors import purple, red
 from config import BOT_COLOR
 
 qtickets = bot.db.queries.tickets
@@ -29,21 +36,44 @@ class TrackerCog(CogBase):
             "untrack": "Stop tracking a channel for tile claims.",
             "view": "A table containing number of tickets used by each member on each day.",
             "member": "Detailed information about a specific member, showing which tiles were claimed and when.",
-            "tile": "Detailed information about a tile, showing how many times it was captured, by whom, and when."
+            "tile": "Detailed information about a tile, showing how many times it was captured, by whom, and when.",
+            "backfill": "Reads back a tracked channel's history for a CT season and registers any tile call or "
+                        "capture that was missed, e.g. because the channel was tracked late. If it gets "
+                        "interrupted, running it again picks up where it left off.",
         }
     }
 
     tickets_group = discord.app_commands.Group(name="tickets", description="Various ticket tracking commands.")
 
+    BACKFILL_BATCH = 500
+
     def __init__(self, bot: commands.Bot) -> None:
         super().__init__(bot)
+        self.message_cache = RecentMessageCache()
+        # "<channel>-<season>" -> checkpoint of a backfill that didn't finish
+        self.backfills: dict[str, dict[str, int]] = {}
+        self.running_backfills: set[str] = set()
 
     async def cog_load(self) -> None:
         await super().cog_load()
+        await qtickets.load_tracked_channels()
         self.task_purge_user_data.start()
 
+    async def serialize_state(self) -> dict[str, Any]:
+        return {
+            "backfills": self.backfills,
+        }
+
+    async def parse_state(self, saved_at: datetime.datetime, state: dict[str, Any]) -> None:
+        if "backfills" in state:
+            self.backfills = state["backfills"]
+
     @tasks.loop(seconds=3600 * 24)
     async def task_purge_user_data(self) -> None:
+        try:
+            await qtickets.ensure_claims_partitions()
+        except asyncpg.PostgresError as exc:
+            print(f"{purple('[Tracker]')} {red(f'Could not create claims partitions: {exc}')}")
         await qtickets.purge_old_tickets()
 
     @tickets_group.command(name="track", description="Track a channel.")
@@ -62,6 +92,7 @@ class TrackerCog(CogBase):
     @discord.app_commands.checks.has_permissions(manage_guild=True)
     async def cmd_untrack(self, interaction: discord.Interaction, channel: discord.TextChannel) -> None:
         await qtickets.untrack_channel(channel.id)
+        self.message_cache.remove_channel(channel.id)
         await interaction.response.send_message(f"I am no longer tracking <#{channel.id}>", ephemeral=True)
 
     @tickets_group.command(name="view", description="See how many tickets each member used.")
@@ -84,26 +115,15 @@ class TrackerCog(CogBase):
         row = "`{:10.10}` | `{:<2}` | `{:<2}` | `{:<2}` | `{:<2}` | `{:<2}` | `{:<2}` | `{:<2}`\n"
 
         claims = await qtickets.get_ticket_overview(channel.id, season)
+        names = await member_resolver.get_display_names(interaction.guild, list(claims.keys()))
 
-        async def get_member(uid: int) -> discord.Member:
-            member = interaction.guild.get_member(uid)
-            if member is None:
-                member = await interaction.guild.fetch_member(uid)
-            return member
-
-        members = await asyncio.gather(*[
-            get_member(uid) for uid in claims
-        ], return_exceptions=True)
         total_claims = [0] * 7
-        for member in members:
-            if type(member) is discord.NotFound:
+        for uid in claims:
+            if uid not in names:
                 continue
-            message += row.format(
-                member.display_name if member else str(member.id),
-                *[len(day_claims) for day_claims in claims[member.id]]
-            )
-            for i in range(len(claims[member.id])):
-                total_claims[i] += len(claims[member.id][i])
+            message += row.format(names[uid], *claims[uid])
+            for i in range(len(claims[uid])):
+                total_claims[i] += claims[uid][i]
         message += row.format("Total", *total_claims)
 
         await interaction.edit_original_response(content=message)
@@ -199,14 +219,148 @@ class TrackerCog(CogBase):
             ),
         )
 
+    @tickets_group.command(name="backfill", description="Register missed tile claims from a channel's history.")
+    @discord.app_commands.describe(channel="The tracked channel to read back.",
+                                   season="The CT season to backfill. Defaults to the current one.")
+    @discord.app_commands.guild_only()
+    @discord.app_commands.default_permissions(administrator=True)
+    @discord.app_commands.checks.has_permissions(manage_guild=True)
+    async def cmd_backfill(self,
+                           interaction: discord.Interaction,
+                           channel: discord.TextChannel,
+                           season: None or int = 0) -> None:
+        if channel.id not in (await qtickets.tracked_channels()):
+            await interaction.response.send_message("That channel is not being tracked!", ephemeral=True)
+            return
+        if season == 0:
+            season = get_ct_number_during(datetime.datetime.now())
+        key = f"{channel.id}-{season}"
+        if key in self.running_backfills:
+            await interaction.response.send_message("That channel is already being backfilled!", ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True)
+        self.running_backfills.add(key)
+        try:
+            checkpoint = await self.backfill_channel(channel, season, interaction)
+        except Exception as exc:
+            str_traceback = io.StringIO()
+            traceback.print_exception(exc, file=str_traceback)
+            print(f"{purple('[Tracker]')} {red(f'Backfill of #{channel.id} for CT {season} failed')}\n"
+                  f"{str_traceback.getvalue().rstrip()}")
+            try:
+                await interaction.edit_original_response(
+                    content=f"Something went wrong while backfilling <#{channel.id}>! The progress so far "
+                            f"has been saved, run this command again to pick up where it left off."
+                )
+            except discord.HTTPException:
+                pass  # Interaction tokens expire after 15 minutes
+            return
+        finally:
+            self.running_backfills.remove(key)
+
+        try:
+            await interaction.edit_original_response(
+                content=f"Done! Read {checkpoint['messages']:,} messages from <#{channel.id}> and "
+                        f"registered {checkpoint['claims']:,} tile claims for CT {season}."
+            )
+        except discord.HTTPException:
+            pass  # Interaction tokens expire after 15 minutes
+
+    async def backfill_channel(self,
+                               channel: discord.TextChannel,
+                               season: int,
+                               interaction: discord.Interaction) -> dict[str, int]:
+        """
+        Walks a channel's history during a CT season and registers every tile call & capture in it.
+        Claims are written in batches while the next page of history is read, and a checkpoint is saved
+        after every batch so an interrupted backfill can be resumed.
+        :return: The final checkpoint.
+        """
+        key = f"{channel.id}-{season}"
+        event_start, event_end = get_ct_period_during(event=season)
+        checkpoint = self.backfills.get(key, {"last_message": None, "messages": 0, "claims": 0})
+        after = event_start if checkpoint["last_message"] is None else discord.Object(checkpoint["last_message"])
+
+        async def write_batch(claims: list, last_message: int, messages_read: int) -> None:
+            await qtickets.backfill_claims(channel.id, claims)
+            checkpoint["last_message"] = last_message
+            checkpoint["messages"] = messages_read
+            checkpoint["claims"] += len(claims)
+            self.backfills[key] = checkpoint
+            await self._save_state()
+            try:
+                await interaction.edit_original_response(
+                    content=f"Backfilling <#{channel.id}>... {checkpoint['messages']:,} messages read, "
+                            f"{checkpoint['claims']:,} tile claims found so far."
+                )
+            except discord.HTTPException:
+                pass
+
+        pending_write = None
+        batch = []
+        messages_read = checkpoint["messages"]
+        last_message = checkpoint["last_message"]
+        try:
+            async for message in channel.history(limit=None, after=after, before=event_end, oldest_first=True):
+                messages_read += 1
+                last_message = message.id
+                if (tile := self.parse_tile(message.content)) is None:
+                    continue
+                # Reaction times aren't available, the message's is the closest we've got
+                sent_at = message.created_at.astimezone().replace(tzinfo=None)
+                is_captured = any(str(r.emoji) in tracked_emojis for r in message.reactions)
+                batch.append((message.author.id, tile, message.id, sent_at, sent_at if is_captured else None))
+
+                if len(batch) >= self.BACKFILL_BATCH:
+                    if pending_write is not None:
+                        await pending_write
+                    pending_write = asyncio.create_task(write_batch(batch, last_message, messages_read))
+                    batch = []
+
+            if pending_write is not None:
+                await pending_write
+            await write_batch(batch, last_message, messages_read)
+        finally:
+            # If reading the history failed, let the batch in flight finish so its checkpoint is saved
+            if pending_write is not None and not pending_write.done():
+                await asyncio.gather(pending_write, return_exceptions=True)
+
+        del self.backfills[key]
+        await self._save_state()
+        return checkpoint
+
+    @staticmethod
+    def parse_tile(content: str) -> str | None:
+        if (match := re.search(tile_re, content)) is None:
+            return None
+        return match.group(1).upper()
+
+    def cache_message(self, message: discord.Message) -> CachedMessage:
+        """Caches a message fetched from Discord, along with its current tracked reactions."""
+        return self.message_cache.put(message.channel.id, CachedMessage(
+            message.id,
+            message.author.id,
+            self.parse_tile(message.content),
+            {str(r.emoji): r.count for r in message.reactions if str(r.emoji) in tracked_emojis},
+        ))
+
+    async def get_message(self, channel_id: int, message_id: int) -> CachedMessage:
+        if (cached := self.message_cache.get(channel_id, message_id)) is not None:
+            return cached
+        channel = self.bot.get_channel(channel_id)
+        return self.cache_message(await channel.fetch_message(message_id))
+
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message) -> None:
-        if (match := re.search(tile_re, message.content)) is None or \
-                message.channel.id not in (await qtickets.tracked_channels()):
+        if message.channel.id not in (await qtickets.tracked_channels()):
+            return
+        # New messages have no reactions yet, so their reaction state starts out complete
+        cached = self.cache_message(message)
+        if (tile := cached.tile) is None:
             return
-        tile = match.group(1).upper()
 
-        asyncio.create_task(self.bot.signal("on_tile_started", tile, message.channel.id, message))
+        self.bot.events.emit("on_tile_started", tile, message.channel.id, message)
 
         if await qtickets.is_tile_called(message.channel.id, tile, message.author.id):
             await message.add_reaction(WARN_ALREADY_CLAIMED)
@@ -215,20 +369,29 @@ class TrackerCog(CogBase):
 
     @commands.Cog.listener()
     async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent) -> None:
-        await qtickets.delete_claim(payload.message_id)
+        if payload.channel_id not in (await qtickets.tracked_channels()):
+            return
+        self.message_cache.remove(payload.channel_id, payload.message_id)
+        await qtickets.delete_claim(payload.message_id, payload.channel_id)
 
     @commands.Cog.listener()
     async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent) -> None:
-        if not await qtickets.get_capture_by_message(payload.message_id):
+        if payload.channel_id not in (await qtickets.tracked_channels()):
             return
 
-        channel = self.bot.get_channel(payload.channel_id)
-        message = await channel.fetch_message(payload.message_id)
-        if (match := re.search(tile_re, message.content)) is None:
-            await qtickets.delete_claim(payload.message_id)
+        # Edits that don't touch the content (e.g. embeds loading) don't carry it in the payload
+        cached = self.message_cache.get(payload.channel_id, payload.message_id)
+        if cached is not None and "content" in payload.data:
+            cached.tile = self.parse_tile(payload.data["content"])
+
+        if not await qtickets.get_capture_by_message(payload.message_id):
+            return
+        if cached is None:
+            cached = await self.get_message(payload.channel_id, payload.message_id)
+        if cached.tile is None:
+            await qtickets.delete_claim(payload.message_id, payload.channel_id)
             return
-        tile = match.group(1).upper()
-        await qtickets.call_tile(payload.channel_id, tile, payload.message_id, edit=True)
+        await qtickets.call_tile(payload.channel_id, cached.tile, payload.message_id, edit=True)
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent) -> None:
@@ -236,21 +399,24 @@ class TrackerCog(CogBase):
                 payload.channel_id not in (await qtickets.tracked_channels()):
             return
 
+        if (cached := self.message_cache.get(payload.channel_id, payload.message_id)) is not None:
+            cached.add_reaction(str(payload.emoji))
+
         if claim := await qtickets.get_capture_by_message(payload.message_id):
-            await qtickets.capture(payload.message_id)
+            await qtickets.capture(payload.message_id, channel=claim.channel_id, tile=claim.tile)
             tile = claim.tile
         else:
-            channel = self.bot.get_channel(payload.channel_id)
-            message = await channel.fetch_message(payload.message_id)
-            if (match := re.search(tile_re, message.content)) is None:
+            if cached is None:
+                # A freshly fetched message already counts this reaction
+                cached = await self.get_message(payload.channel_id, payload.message_id)
+            if (tile := cached.tile) is None:
                 return
 
-            tile = match.group(1).upper()
             if not await is_tile_code_valid(tile):
                 return
             await qtickets.capture(payload.message_id, tile=tile, user=payload.user_id, channel=payload.channel_id)
 
-        await self.bot.signal("on_tile_captured", tile, payload.channel_id, payload.user_id)
+        self.bot.events.emit("on_tile_captured", tile, payload.channel_id, payload.user_id)
 
     @commands.Cog.listener()
     async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent) -> None:
@@ -258,15 +424,44 @@ class TrackerCog(CogBase):
                 payload.channel_id not in (await qtickets.tracked_channels()):
             return
 
-        channel = self.bot.get_channel(payload.channel_id)
-        message = await channel.fetch_message(payload.message_id)
-        for reaction in message.reactions:
-            if reaction.emoji in tracked_emojis:
-                return
-        capture = await qtickets.get_capture_by_message(payload.message_id)
-        await qtickets.uncapture(payload.message_id)
-        if capture is not None:
-            await self.bot.signal("on_tile_uncaptured", capture.tile, capture.channel_id, capture.user_id)
+        if (cached := self.message_cache.get(payload.channel_id, payload.message_id)) is not None:
+            cached.remove_reaction(str(payload.emoji))
+        else:
+            cached = await self.get_message(payload.channel_id, payload.message_id)
+        if cached.has_reactions:
+            return
+        await self.release_capture(payload.message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_clear(self, payload: discord.RawReactionClearEvent) -> None:
+        if payload.channel_id not in (await qtickets.tracked_channels()):
+            return
+        if (cached := self.message_cache.get(payload.channel_id, payload.message_id)) is not None:
+            cached.clear_reactions()
+        await self.release_capture(payload.message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_clear_emoji(self, payload: discord.RawReactionClearEmojiEvent) -> None:
+        if str(payload.emoji) not in tracked_emojis or \
+                payload.channel_id not in (await qtickets.tracked_channels()):
+            return
+
+        if (cached := self.message_cache.get(payload.channel_id, payload.message_id)) is not None:
+            cached.clear_reactions(str(payload.emoji))
+        else:
+            cached = await self.get_message(payload.channel_id, payload.message_id)
+        if cached.has_reactions:
+            return
+        await self.release_capture(payload.message_id)
+
+    async def release_capture(self, message_id: int) -> None:
+        """Uncaptures the tile claimed by a message that has no tracked reactions left."""
+        capture = await qtickets.get_capture_by_message(message_id)
+        if capture is None:
+            await qtickets.uncapture(message_id)
+        else:
+            await qtickets.uncapture(message_id, capture.channel_id, capture.tile)
+            self.bot.events.emit("on_tile_uncaptured", capture.tile, capture.channel_id, capture.user_id)
 
 
 async def setup(bot: commands.Bot) -> None:
@@ -3,6 +3,7 @@ import discord
 from typing import Any
 from discord.ext import commands, tasks
 from datetime import datetime, timedelta
+from bot.utils.MemberResolver import member_resolver
 from .CogBase import CogBase
 
 
@@ -58,9 +59,10 @@ class WelcomeCog(CogBase):
 
         pandemonium = await self.get_guild(self.PANDEMONIUM_GID)
         visitor_role = discord.utils.get(pandemonium.roles, id=self.VISITOR_ROLE_ID)
+        members = await member_resolver.get_members(pandemonium, to_remove)
         for uid in to_remove:
             del self.waiting_rooms[uid]
-            member = pandemonium.get_member(uid)
+            member = members.get(uid)
             if member is not None:
                 await member.add_roles(visitor_role)
                 try:
@@ -166,9 +168,9 @@ class WelcomeCog(CogBase):
         if payload.member:
             member = payload.member
         else:
-            member = guild.get_member(payload.user_id)
+            member = await member_resolver.get_member(guild, payload.user_id)
             if member is None:
-                member = await guild.fetch_member(payload.user_id)
+                return
 
         channel = guild.get_channel(payload.channel_id)
         if channel is None:
@@ -0,0 +1,140 @@
+import asyncio
+from typing import Any, Hashable
+import bot.db.connection
+postgres = bot.db.connection.postgres
+
+
+class BatchQueue:
+    """
+    Collects single-row write statements for a few milliseconds and applies them
+    all in one transaction. Statements are applied in the order they were queued,
+    consecutive ones with the same query being sent together with executemany.
+    Statements can ask for an advisory lock on a key, which is taken at the start of the
+    transaction and held until it commits, so other connections writing under the same key
+    wait for it and then see its rows.
+    Statements can also be tagged with what they touch, so reads only have to flush the
+    queue when it holds writes they depend on.
+    """
+    instances: list["BatchQueue"] = []
+
+    def __init__(self, delay: float = 0.02, max_size: int = 500):
+        self.delay = delay
+        self.max_size = max_size
+        self._pending: list[tuple[str, tuple[Any, ...], int | None, tuple[Hashable, ...], asyncio.Future]] = []
+        self._in_flight: list[tuple[str, tuple[Any, ...], int | None, tuple[Hashable, ...], asyncio.Future]] = []
+        self._timer: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+        self._tasks: set[asyncio.Task] = set()
+        BatchQueue.instances.append(self)
+
+    async def put(self,
+                  query: str,
+                  *args: Any,
+                  lock_key: int | None = None,
+                  tags: tuple[Hashable, ...] = ()) -> None:
+        """
+        Queues a statement and waits until the batch it's in is committed.
+        :param lock_key: Key of the advisory lock to hold while it runs, if any.
+        :param tags: What the statement touches, see flush_for.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((query, args, lock_key, tags, future))
+        if len(self._pending) >= self.max_size:
+            task = asyncio.create_task(self.flush())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+        await future
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.delay)
+        await self.flush()
+
+    async def flush_for(self, *tags: Hashable) -> None:
+        """
+        Same as flush, but only if a statement that's queued or being committed is tagged
+        with one of the tags. Otherwise there's nothing a read depending on them has to wait for.
+        """
+        for entry in self._pending + self._in_flight:
+            if any(tag in entry[3] for tag in tags):
+                await self.flush()
+                return
+
+    async def flush(self) -> None:
+        """
+        Commits everything that's queued. Also waits for a batch that's already being
+        committed, so reads made right after see every write queued before them.
+        Never call this while holding a pool connection: the batch needs one of its own,
+        and readers holding them all while waiting on the lock would starve the pool.
+        """
+        # The lock makes sure batches are committed in the order they were taken
+        async with self._lock:
+            batch, self._pending = self._pending, []
+            if len(batch) == 0:
+                return
+            self._in_flight = batch
+            try:
+                try:
+                    await self._execute_batch(batch)
+                except Exception:
+                    # Fall back to one statement at a time so a single bad row
+                    # only fails its own caller instead of the whole batch.
+                    for query, args, lock_key, _t, future in batch:
+                        try:
+                            await self._execute_one(query, args, lock_key)
+                        except Exception as exc:
+                            future.set_exception(exc)
+                for _q, _a, _k, _t, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+            finally:
+                self._in_flight = []
+                # Cancelled partway through, whether they were committed is unknown
+                for _q, _a, _k, _t, future in batch:
+                    if not future.done():
+                        future.cancel()
+
+    @staticmethod
+    @postgres
+    async def _execute_batch(batch: list[tuple[str, tuple[Any, ...], int | None, tuple[Hashable, ...], asyncio.Future]],
+                             conn=None) -> None:
+        groups: list[tuple[str, list[tuple[Any, ...]]]] = []
+        for query, args, _k, _t, _f in batch:
+            if len(groups) > 0 and groups[-1][0] == query:
+                groups[-1][1].append(args)
+            else:
+                groups.append((query, [args]))
+
+        async with conn.transaction():
+            await lock_keys([key for _q, _a, key, _t, _f in batch if key is not None], conn)
+            for query, args_list in groups:
+                if len(args_list) == 1:
+                    await conn.execute(query, *args_list[0])
+                else:
+                    await conn.executemany(query, args_list)
+
+    @staticmethod
+    @postgres
+    async def _execute_one(query: str, args: tuple[Any, ...], lock_key: int | None, conn=None) -> None:
+        async with conn.transaction():
+            if lock_key is not None:
+                await lock_keys([lock_key], conn)
+            await conn.execute(query, *args)
+
+    @staticmethod
+    async def flush_all() -> None:
+        await asyncio.gather(*[queue.flush() for queue in BatchQueue.instances])
+
+
+async def lock_keys(keys: list[int], conn) -> None:
+    """
+    Takes transaction-level advisory locks on some keys. They're always taken in ascending
+    order, so two transactions locking overlapping keys can't deadlock.
+    """
+    if len(keys) == 0:
+        return
+    await conn.execute("""
+        SELECT pg_advisory_xact_lock(k)
+        FROM (SELECT DISTINCT k FROM UNNEST($1::BIGINT[]) AS k ORDER BY k) keys
+    """, keys)
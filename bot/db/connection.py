@@ -1,9 +1,13 @@
+import os
+import re
 import asyncpg
 import config
 from bot.utils.colors import red, purple
 from functools import wraps
 
 pool: asyncpg.Pool | None
+MIGRATIONS_PATH = "db_migrations"
+CONCURRENT_INDEX_RE = r"(?i)CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)"
 
 
 async def start():
@@ -16,6 +20,70 @@ async def start():
         print(f"{purple('[PSQL]')} Connected")
     except:
         print(f"{purple('[PSQL]')} {red('Error connecting to Postgres database')}")
+        return
+
+    try:
+        await migrate()
+    except Exception as exc:
+        print(f"{purple('[PSQL]')} {red(f'Error applying migrations: {exc}')}")
+        raise
+
+
+async def migrate() -> None:
+    """
+    Applies every migration in MIGRATIONS_PATH that wasn't applied yet, in order.
+    Files are named `<version>_<description>.sql` and each runs as a whole in its own
+    transaction, along with its entry in schema_migrations.
+    `CREATE INDEX CONCURRENTLY` can't run in a transaction, so a migration using it must
+    contain nothing else. It's run by itself, and an invalid index left behind by a previous
+    failed attempt is dropped first so it gets rebuilt.
+    """
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT NOT NULL,
+                name VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY(version)
+            )
+        """)
+        applied = {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+
+        migrations = sorted(
+            (int(fname.split("_")[0]), fname)
+            for fname in os.listdir(MIGRATIONS_PATH)
+            if fname.endswith(".sql")
+        )
+        for version, fname in migrations:
+            if version in applied:
+                continue
+            with open(os.path.join(MIGRATIONS_PATH, fname)) as fin:
+                sql = fin.read()
+
+            if (match := re.search(CONCURRENT_INDEX_RE, sql)) is not None:
+                await drop_invalid_index(match.group(1), conn)
+                await conn.execute(sql)
+                await conn.execute("INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", version, fname)
+            else:
+                async with conn.transaction():
+                    await conn.execute(sql)
+                    await conn.execute("INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                                       version, fname)
+            print(f"{purple('[PSQL]')} Applied migration {fname}")
+
+
+async def drop_invalid_index(name: str, conn: asyncpg.Connection) -> None:
+    """Drops an index if a failed CREATE INDEX CONCURRENTLY left it behind as invalid."""
+    is_invalid = await conn.fetchval("""
+        SELECT NOT i.indisvalid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = $1
+            AND c.relnamespace = current_schema()::regnamespace
+    """, name)
+    if is_invalid:
+        await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+        print(f"{purple('[PSQL]')} Dropped invalid index {name}")
 
 
 def postgres(wrapped):
@@ -0,0 +1,10 @@
+import datetime
+from dataclasses import dataclass
+
+
+@dataclass
+class TeamSnapshot:
+    team_id: str
+    taken_at: datetime.datetime  #: The hour of the leaderboard update it's from
+    score: int
+    placement: int  #: 1-indexed
@@ -1,7 +1,9 @@
 import time
+import datetime
 import bot.db.connection
 import bot.utils.bloons
 from ..model.LeaderboardChannel import LeaderboardChannel
+from ..model.LeaderboardSnapshot import TeamSnapshot
 postgres = bot.db.connection.postgres
 
 
@@ -23,3 +25,58 @@ async def remove_leaderboard_channel(guild: int, channel: int, conn=None) -> Non
 async def leaderboard_channels(conn=None) -> list[LeaderboardChannel]:
     payload = await conn.fetch("SELECT guild, channel FROM lbchannels")
     return [LeaderboardChannel(row["guild"], row["channel"]) for row in payload]
+
+
+@postgres
+async def save_leaderboard_snapshot(event_id: str,
+                                    taken_at: datetime.datetime,
+                                    teams: list[tuple[str, int]],
+                                    conn=None) -> None:
+    """
+    Saves an hourly leaderboard snapshot, replacing any already taken at that time.
+    :param event_id: The ID of the CT event.
+    :param taken_at: The hour of the update.
+    :param teams: (team ID, score) of every team, in placement order.
+    """
+    records = [(event_id, taken_at, team_id, score, i+1) for i, (team_id, score) in enumerate(teams)]
+    async with conn.transaction():
+        await conn.execute("""
+            DELETE FROM leaderboard_snapshots WHERE event_id=$1 AND taken_at=$2
+        """, event_id, taken_at)
+        await conn.copy_records_to_table(
+            "leaderboard_snapshots",
+            records=records,
+            columns=["event_id", "taken_at", "team_id", "score", "placement"],
+        )
+
+
+@postgres
+async def get_leaderboard_snapshot(event_id: str, taken_at: datetime.datetime, conn=None) -> list[TeamSnapshot]:
+    """Returns the leaderboard snapshot taken at a given hour, in placement order."""
+    payload = await conn.fetch("""
+        SELECT team_id, taken_at, score, placement
+        FROM leaderboard_snapshots
+        WHERE event_id=$1 AND taken_at=$2
+        ORDER BY placement
+    """, event_id, taken_at)
+    return [TeamSnapshot(row["team_id"], row["taken_at"], row["score"], row["placement"]) for row in payload]
+
+
+@postgres
+async def get_team_history(event_id: str,
+                           team_id: str,
+                           since: datetime.datetime = None,
+                           conn=None) -> list[TeamSnapshot]:
+    """
+    Returns every snapshot of a team during an event, oldest first.
+    :param since: Only return snapshots taken from then on, e.g. to get the team's recent trend.
+    """
+    if since is None:
+        since = datetime.datetime.min
+    payload = await conn.fetch("""
+        SELECT team_id, taken_at, score, placement
+        FROM leaderboard_snapshots
+        WHERE event_id=$1 AND team_id=$2 AND taken_at >= $3
+        ORDER BY taken_at
+    """, event_id, team_id, since)
+    return [TeamSnapshot(row["team_id"], row["taken_at"], row["score"], row["placement"]) for row in payload]
@@ -1,8 +1,10 @@
 import time
 import datetime
+import asyncpg
 import bot.db.connection
 import bot.utils.bloons
 from typing import Any, Literal
+from . import tickets
 from ..model.Planner import Planner
 from ..model.PlannedTile import PlannedTile
 postgres = bot.db.connection.postgres
@@ -81,100 +83,141 @@ async def get_planned_tiles(planner_channel: int,
                             claimed_status: Literal["UNCLAIMED", "CLAIMED", "ANY"] = "ANY",
                             conn=None) -> list[PlannedTile]:
     event_start, _event_end = bloons.get_current_ct_period()
-    tile_captures = """
-        SELECT c.tile, c.claimed_at, ptc.user_id, p.claims_channel, p.ping_role, p.ping_channel, p.planner_channel,
-            ptt.expires_after_hr, c.claimed_at + MAKE_INTERVAL(hours => ptt.expires_after_hr) AS expires_at
-        FROM (
-            claims c JOIN planners p ON c.channel = p.claims_channel
-            JOIN plannertrackedtiles ptt
-                ON ptt.planner_channel = p.planner_channel
-                    AND ptt.tile = c.tile
-            ) LEFT JOIN plannertileclaims ptc
-                ON p.planner_channel = ptc.planner_channel AND c.tile = ptc.tile
-        WHERE p.planner_channel = $3
-            AND c.claimed_at >= $1
-            AND c.tile = ANY($2::VARCHAR(3)[])
-        ORDER BY expires_at ASC
-    """
+    partition_start, _pe = tickets.claims_partition_range(bloons.get_current_ct_number())
 
     extra_args = []
     q_between = ""
     if expire_between is not None:
         q_between = f"""
-            AND expires_at >= ${len(extra_args) + 4}
-            AND expires_at < ${len(extra_args) + 5}
+            AND expires_at >= ${len(extra_args) + 5}
+            AND expires_at < ${len(extra_args) + 6}
         """
         extra_args.append(expire_between[0])
         extra_args.append(expire_between[1])
     q_claim = ""
     if claimed_status == "UNCLAIMED":
-        q_claim = "AND tcap.user_id IS NULL"
+        q_claim = "AND user_id IS NULL"
     elif claimed_status == "CLAIMED":
-        q_claim = "AND tcap.user_id IS NOT NULL"
+        q_claim = "AND user_id IS NOT NULL"
 
+    # The latest capture of each tile, found in a single scan. Filtering out captures from
+    # before the clear time first is the same as checking the latest one against it.
     banners = await conn.fetch(f"""
         SELECT *
-        FROM ({tile_captures}) tcap
-        WHERE claimed_at = (
-            SELECT MAX(claimed_at)
-            FROM ({tile_captures}) tcap2
-            WHERE tcap.tile = tcap2.tile
-        ) AND (
-            (SELECT clear_time FROM planners WHERE planner_channel = $3) IS NULL
-            OR claimed_at >= (SELECT clear_time FROM planners WHERE planner_channel = $3)
-        )
+        FROM (
+            SELECT DISTINCT ON (c.tile)
+                c.tile, c.claimed_at, ptc.user_id, p.claims_channel, p.ping_role, p.ping_channel,
+                p.planner_channel, ptt.expires_after_hr,
+                c.claimed_at + MAKE_INTERVAL(hours => ptt.expires_after_hr) AS expires_at
+            FROM planners p
+            JOIN plannertrackedtiles ptt
+                ON ptt.planner_channel = p.planner_channel
+            JOIN claims c
+                ON c.channel = p.claims_channel
+                    AND c.tile = ptt.tile
+            LEFT JOIN plannertileclaims ptc
+                ON ptc.planner_channel = p.planner_channel
+                    AND ptc.tile = c.tile
+            WHERE p.planner_channel = $3
+                AND c.claimed_at >= $1
+                AND c.called_at >= $4
+                AND c.tile = ANY($2::VARCHAR(3)[])
+                AND (p.clear_time IS NULL OR c.claimed_at >= p.clear_time)
+            ORDER BY c.tile, c.claimed_at DESC
+        ) latest
+        WHERE TRUE
         {q_between}
         {q_claim}
-    """, event_start, tile_codes, planner_channel, *extra_args)
+        ORDER BY expires_at ASC
+    """, event_start, tile_codes, planner_channel, partition_start, *extra_args)
     return [PlannedTile(row["tile"], row["claimed_at"], row["user_id"], row["planner_channel"], row["claims_channel"],
                         row["ping_role"], row["ping_channel"], row["expires_after_hr"])
             for row in banners]
 
 
 @postgres
-async def get_tile_closest_to_expire(from_date: datetime.datetime,
-                                     conn=None) -> list[PlannedTile]:
-    # Latest expire for every tile for every claim channel
-    latest_expire = f"""
-        SELECT channel, tile, MAX(claimed_at) as claimed_at
-        FROM claims
-        WHERE claimed_at IS NOT NULL
-        GROUP BY (channel, tile)
+async def get_expiring_tiles(expire_from: datetime.datetime,
+                             expire_to: datetime.datetime,
+                             expire_to_unclaimed: datetime.datetime | None = None,
+                             conn=None) -> dict[int, list[PlannedTile]]:
     """
-
-    # Earliest expire for each planner
-    earliest_expire = f"""
-        SELECT p.planner_channel, MIN(c.claimed_at + MAKE_INTERVAL(hours => ptt.expires_after_hr)) AS expires_at
+    Gets the tiles of every active planner with a ping channel that expire soon, in one query.
+    :param expire_from: Tiles must expire after this.
+    :param expire_to: Tiles must expire before this.
+    :param expire_to_unclaimed: Unclaimed tiles may also expire before this, if given.
+    :return: The tiles grouped by planner, sorted by expire time.
+    """
+    event_start, _event_end = bloons.get_current_ct_period()
+    partition_start, _pe = tickets.claims_partition_range(bloons.get_current_ct_number())
+    rows = await conn.fetch("""
+        SELECT *
         FROM (
-            ({latest_expire}) c JOIN planners p ON c.channel = p.claims_channel
+            SELECT DISTINCT ON (p.planner_channel, c.tile)
+                c.tile, c.claimed_at, ptc.user_id, p.claims_channel, p.ping_role, p.ping_channel,
+                p.planner_channel, ptt.expires_after_hr,
+                c.claimed_at + MAKE_INTERVAL(hours => ptt.expires_after_hr) AS expires_at
+            FROM planners p
             JOIN plannertrackedtiles ptt
                 ON ptt.planner_channel = p.planner_channel
-                    AND ptt.tile = c.tile
-            )
+            JOIN claims c
+                ON c.channel = p.claims_channel
+                    AND c.tile = ptt.tile
             LEFT JOIN plannertileclaims ptc
-                ON p.planner_channel = ptc.planner_channel AND c.tile = ptc.tile
-        WHERE c.claimed_at + MAKE_INTERVAL(hours => ptt.expires_after_hr) >= $1
-        GROUP BY(p.planner_channel)
-    """
-
-    latest_tile_captures = f"""
-        SELECT eexp.expires_at, p.planner_channel, c.tile, p.claims_channel, ptc.user_id, p.ping_channel, p.ping_role,
-            c.claimed_at, ptt.expires_after_hr
-        FROM ({earliest_expire}) AS eexp JOIN (
-            claims c JOIN planners p ON c.channel = p.claims_channel
-            JOIN plannertrackedtiles ptt
-                ON ptt.planner_channel = p.planner_channel
-                    AND ptt.tile = c.tile
+                ON ptc.planner_channel = p.planner_channel
+                    AND ptc.tile = c.tile
+            WHERE p.is_active
+                AND p.ping_channel IS NOT NULL
+                AND c.claimed_at >= $1
+                AND c.called_at >= $2
+                AND (p.clear_time IS NULL OR c.claimed_at >= p.clear_time)
+            ORDER BY p.planner_channel, c.tile, c.claimed_at DESC
+        ) latest
+        WHERE expires_at >= $3
+            AND (
+                expires_at < $4
+                OR user_id IS NULL AND expires_at < $5
             )
-            LEFT JOIN plannertileclaims ptc
-                ON p.planner_channel = ptc.planner_channel AND c.tile = ptc.tile
-        ON eexp.expires_at = c.claimed_at + MAKE_INTERVAL(hours => ptt.expires_after_hr)
-    """
+        ORDER BY planner_channel, expires_at ASC
+    """, event_start, partition_start, expire_from, expire_to, expire_to_unclaimed)
+    return group_planned_tiles(rows)
 
-    tiles = await conn.fetch(latest_tile_captures, from_date)
-    return [PlannedTile(row["tile"], row["claimed_at"], row["user_id"], row["planner_channel"], row["claims_channel"],
-                        row["ping_channel"], row["ping_role"], row["expires_after_hr"])
-            for row in tiles]
+
+@postgres
+async def get_all_planned_tiles(conn=None) -> dict[int, list[PlannedTile]]:
+    """Same as get_planned_tiles with all tracked tiles, but for every planner at once."""
+    event_start, _event_end = bloons.get_current_ct_period()
+    partition_start, _pe = tickets.claims_partition_range(bloons.get_current_ct_number())
+    rows = await conn.fetch("""
+        SELECT DISTINCT ON (p.planner_channel, c.tile)
+            c.tile, c.claimed_at, ptc.user_id, p.claims_channel, p.ping_role, p.ping_channel,
+            p.planner_channel, ptt.expires_after_hr
+        FROM planners p
+        JOIN plannertrackedtiles ptt
+            ON ptt.planner_channel = p.planner_channel
+        JOIN claims c
+            ON c.channel = p.claims_channel
+                AND c.tile = ptt.tile
+        LEFT JOIN plannertileclaims ptc
+            ON ptc.planner_channel = p.planner_channel
+                AND ptc.tile = c.tile
+        WHERE c.claimed_at >= $1
+            AND c.called_at >= $2
+            AND (p.clear_time IS NULL OR c.claimed_at >= p.clear_time)
+        ORDER BY p.planner_channel, c.tile, c.claimed_at DESC
+    """, event_start, partition_start)
+    return group_planned_tiles(rows)
+
+
+def group_planned_tiles(rows: list[asyncpg.Record]) -> dict[int, list[PlannedTile]]:
+    planners = {}
+    for row in rows:
+        if row["planner_channel"] not in planners:
+            planners[row["planner_channel"]] = []
+        planners[row["planner_channel"]].append(
+            PlannedTile(row["tile"], row["claimed_at"], row["user_id"], row["planner_channel"], row["claims_channel"],
+                        row["ping_role"], row["ping_channel"], row["expires_after_hr"])
+        )
+    return planners
 
 
 @postgres
@@ -283,6 +326,63 @@ async def get_claims_by(user: int, planner_channel: int, conn=None) -> list[dict
     )
 
 
+@postgres
+async def get_tickets_used_today(planner_channel: int, conn=None) -> dict[int, int]:
+    """
+    Counts how many tickets each member of a planner's team used today, or is expected to use
+    today to recapture tiles they claimed in the planner.
+    :param planner_channel: The ID of the planner.
+    :return: The tickets of every member who used or will use any, keyed by user ID.
+    """
+    event_start, _event_end = bloons.get_current_ct_period()
+    partition_start, _pe = tickets.claims_partition_range(bloons.get_current_ct_number())
+    today = bloons.get_current_ct_day()
+    tickets_day_start = event_start + datetime.timedelta(days=min(today-1, bloons.EVENT_DURATION-1))
+    expire_day_start = event_start + datetime.timedelta(days=today-1)
+    rows = await conn.fetch("""
+        WITH planned AS (
+            SELECT DISTINCT ON (c.tile)
+                ptc.user_id,
+                c.claimed_at + MAKE_INTERVAL(hours => ptt.expires_after_hr) AS expires_at
+            FROM planners p
+            JOIN plannertileclaims ptc
+                ON ptc.planner_channel = p.planner_channel
+            JOIN plannertrackedtiles ptt
+                ON ptt.planner_channel = p.planner_channel
+                    AND ptt.tile = ptc.tile
+            JOIN claims c
+                ON c.channel = p.claims_channel
+                    AND c.tile = ptc.tile
+            WHERE p.planner_channel = $1
+                AND ptc.claimed_at >= $2
+                AND c.claimed_at >= $2
+                AND c.called_at >= $3
+                AND (p.clear_time IS NULL OR ptc.claimed_at >= p.clear_time AND c.claimed_at >= p.clear_time)
+            ORDER BY c.tile, c.claimed_at DESC
+        )
+        SELECT user_id, SUM(tickets)::INT AS tickets
+        FROM (
+            SELECT c.userid AS user_id, COUNT(*) AS tickets
+            FROM claims c
+            JOIN planners p
+                ON p.claims_channel = c.channel
+            WHERE p.planner_channel = $1
+                AND c.claimed_at >= $4
+                AND c.claimed_at < $4 + INTERVAL '1 day'
+                AND c.called_at >= $3
+            GROUP BY c.userid
+            UNION ALL
+            SELECT user_id, COUNT(*) AS tickets
+            FROM planned
+            WHERE expires_at >= $5
+                AND expires_at < $5 + INTERVAL '1 day'
+            GROUP BY user_id
+        ) used
+        GROUP BY user_id
+    """, planner_channel, event_start, partition_start, tickets_day_start, expire_day_start)
+    return {row["user_id"]: row["tickets"] for row in rows}
+
+
 @postgres
 async def turn_planner(planner: int, active: bool, conn=None) -> None:
     await conn.execute("UPDATE planners SET is_active=$1 WHERE planner_channel=$2", active, planner)
@@ -342,6 +442,20 @@ async def get_planner_tracked_tiles(planner_id: int, conn=None) -> list[str]:
     return [r["tile"] for r in result]
 
 
+@postgres
+async def get_all_tracked_tiles(conn=None) -> dict[int, list[str]]:
+    """Returns the tracked tiles of every planner."""
+    result = await conn.fetch("""
+        SELECT planner_channel, tile FROM plannertrackedtiles
+    """)
+    planners = {}
+    for r in result:
+        if r["planner_channel"] not in planners:
+            planners[r["planner_channel"]] = []
+        planners[r["planner_channel"]].append(r["tile"])
+    return planners
+
+
 @postgres
 async def overwrite_planner_tiles(planner_id: int, tiles: list[tuple[str, int]], conn=None) -> None:
     async with conn.transaction():
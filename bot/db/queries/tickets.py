@@ -2,9 +2,31 @@ import time
 import datetime
 import bot.db.connection
 import bot.utils.bloons
+from ..BatchQueue import BatchQueue, lock_keys
 from ..model.TileCapture import TileCapture
 postgres = bot.db.connection.postgres
 bloons = bot.utils.bloons
+# Tile calls & captures come in bursts around reset, so they're written in batches
+claims_queue = BatchQueue()
+# Every queued write is tagged with the message and, as precisely as it's known, the tile it
+# changes. Reads only flush the queue when it holds a write they depend on, see BatchQueue.flush_for.
+ANY_TILE = ("tile", None)
+
+
+def claim_tags(message: int, channel: int = None, tile: str = None) -> tuple[tuple, tuple]:
+    if channel is None:
+        return ("message", message), ANY_TILE
+    if tile is None:
+        return ("message", message), ("tile", channel)
+    return ("message", message), ("tile", channel, tile)
+
+
+# The partition key is part of claims' primary key, so it can't keep a message from being
+# registered twice. Statements that add claims hold an advisory lock on the message instead.
+
+# Mirror of the teams table. Loaded once and kept in sync by track_channel/untrack_channel,
+# so the hot paths in TrackerCog never have to hit the database to check it.
+tracked_channels_cache: set[int] | None = None
 
 
 @postgres
@@ -13,38 +35,44 @@ async def track_channel(channel: int, conn=None) -> None:
             INSERT INTO teams (channel) VALUES ($1)
                 ON CONFLICT DO NOTHING
             """, channel)
+    if tracked_channels_cache is not None:
+        tracked_channels_cache.add(channel)
 
 
 @postgres
 async def untrack_channel(channel: int, conn=None) -> None:
     await conn.execute("DELETE FROM teams WHERE channel=$1",
                        channel)
+    # Claims are removed by the ON DELETE CASCADE, the cache has to follow suit
+    if tracked_channels_cache is not None:
+        tracked_channels_cache.discard(channel)
 
 
 @postgres
-async def get_ticket_overview(channel: int, event: int = 0, conn=None) -> dict[int, list[list[TileCapture]]]:
+async def get_ticket_overview(channel: int, event: int = 0, conn=None) -> dict[int, list[int]]:
+    """Returns how many tickets each user used on each day of the event."""
     if event == 0:
         event = bloons.get_ct_number_during(datetime.datetime.now())
     event_start, event_end = bloons.get_ct_period_during(event=event)
+    part_start, part_end = claims_partition_range(event)
     result = await conn.fetch("""
-        SELECT * FROM claims
-            WHERE channel=$1
-              AND claimed_at >= $2
-              AND claimed_at <= $3
-        """, channel, event_start, event_end)
+        SELECT userid, EXTRACT(DAY FROM claimed_at - $2)::INT AS day, COUNT(*) AS captures
+        FROM claims
+        WHERE channel=$1
+          AND claimed_at >= $2
+          AND claimed_at <= $3
+          AND called_at >= $4
+          AND called_at < $5
+        GROUP BY userid, day
+        """, channel, event_start, event_end, part_start, part_end)
 
     claims = {}
     for record in result:
         uid = record["userid"]
         if uid not in claims:
-            claims[uid] = []
-            for _ in range(bloons.EVENT_DURATION):
-                claims[uid].append([])
-        day = (record["claimed_at"] - event_start).days
-        if 0 <= day < bloons.EVENT_DURATION:
-            claims[uid][day].append(
-                TileCapture(uid, record["tile"], channel, record["message"], record["claimed_at"])
-            )
+            claims[uid] = [0] * bloons.EVENT_DURATION
+        if 0 <= record["day"] < bloons.EVENT_DURATION:
+            claims[uid][record["day"]] = record["captures"]
     return claims
 
 
@@ -53,13 +81,16 @@ async def get_tickets_from(member_id: int, channel: int, event: int = 0, conn=No
     if event == 0:
         event = bloons.get_ct_number_during(datetime.datetime.now())
     event_start, event_end = bloons.get_ct_period_during(event=event)
+    part_start, part_end = claims_partition_range(event)
     result = await conn.fetch("""
         SELECT * FROM claims
             WHERE channel=$1
               AND userid=$2
               AND claimed_at >= $3
               AND claimed_at <= $4
-        """, channel, member_id, event_start, event_end)
+              AND called_at >= $5
+              AND called_at < $6
+        """, channel, member_id, event_start, event_end, part_start, part_end)
 
     claims = []
     for _ in range(bloons.EVENT_DURATION):
@@ -74,37 +105,43 @@ async def get_tickets_from(member_id: int, channel: int, event: int = 0, conn=No
 
 
 @postgres
-async def tracked_channels(conn=None) -> list[int]:
+async def load_tracked_channels(conn=None) -> set[int]:
+    global tracked_channels_cache
     payload = await conn.fetch("SELECT channel FROM teams")
-    channels = [row["channel"] for row in payload]
-    return channels
+    tracked_channels_cache = {row["channel"] for row in payload}
+    return tracked_channels_cache
 
 
-@postgres
-async def is_channel_tracked(channel_id: int, conn=None) -> bool:
-    payload = await conn.fetch("SELECT channel FROM teams WHERE channel = $1", channel_id)
-    return len(payload) > 0
+async def tracked_channels() -> set[int]:
+    if tracked_channels_cache is None:
+        return await load_tracked_channels() or set()
+    return tracked_channels_cache
+
+
+async def is_channel_tracked(channel_id: int) -> bool:
+    return channel_id in await tracked_channels()
 
 
-@postgres
 async def call_tile(
         channel: int,
         tile: str,
         message: int,
         user: int = None,
         edit: bool = False,
-        conn=None
 ) -> None:
     if not edit:
-        await conn.execute(
+        await claims_queue.put(
             """
             INSERT INTO claims (userid, tile, channel, message)
-            VALUES ($1, $2, $3, $4)
+            SELECT $1, $2, $3, $4
+            WHERE NOT EXISTS (SELECT 1 FROM claims WHERE message = $4)
             """,
             user, tile, channel, message,
+            lock_key=message,
+            tags=claim_tags(message, channel, tile),
         )
     else:
-        await conn.execute(
+        await claims_queue.put(
             """
             UPDATE claims
             SET tile=$1
@@ -112,15 +149,28 @@ async def call_tile(
                 AND message = $2
             """,
             tile, message,
+            # The tile it's changed from isn't known
+            tags=claim_tags(message, channel),
         )
 
 
-@postgres
 async def is_tile_called(
         channel: int,
         tile: str,
         ignore_user: int,
         minutes_back: int = 90,
+) -> bool:
+    # Flushed before taking a connection, see BatchQueue.flush
+    await claims_queue.flush_for(("tile", channel, tile), ("tile", channel), ANY_TILE)
+    return await _is_tile_called(channel, tile, ignore_user, minutes_back)
+
+
+@postgres
+async def _is_tile_called(
+        channel: int,
+        tile: str,
+        ignore_user: int,
+        minutes_back: int,
         conn=None
 ) -> bool:
     result = await conn.fetchrow(
@@ -138,58 +188,74 @@ async def is_tile_called(
     return result["is_called"]
 
 
-@postgres
-async def delete_claim(message: int, conn=None) -> None:
-    await conn.execute(
+async def delete_claim(message: int, channel: int = None) -> None:
+    await claims_queue.put(
         """
         DELETE FROM claims
         WHERE message = $1
         """,
         message,
+        tags=claim_tags(message, channel),
     )
 
 
-@postgres
 async def capture(
         message: int,
         channel: int = None,
         tile: str = None,
         user: int = None,
-        conn=None
 ) -> None:
+    # clock_timestamp() rather than NOW() so captures batched in the same
+    # transaction still get distinct, correctly ordered times.
     if channel and tile and user:
-        await conn.execute(
+        await claims_queue.put(
             """
+            WITH updated AS (
+                UPDATE claims
+                SET claimed_at = clock_timestamp()
+                WHERE message = $4
+                RETURNING message
+            )
             INSERT INTO claims (userid, tile, channel, message, claimed_at)
-            VALUES ($1, $2, $3, $4, CURRENT_TIMESTAMP)
+            SELECT $1, $2, $3, $4, clock_timestamp()
+            WHERE NOT EXISTS (SELECT 1 FROM updated)
             """,
             user, tile, channel, message,
+            lock_key=message,
+            tags=claim_tags(message, channel, tile),
         )
     else:
-        await conn.execute(
+        await claims_queue.put(
             """
             UPDATE claims
-            SET claimed_at = NOW()
+            SET claimed_at = clock_timestamp()
             WHERE message = $1
             """,
             message,
+            tags=claim_tags(message, channel, tile),
         )
 
 
-@postgres
-async def uncapture(message: int, conn=None) -> None:
-    await conn.execute(
+async def uncapture(message: int, channel: int = None, tile: str = None) -> None:
+    await claims_queue.put(
         """
         UPDATE claims
         SET claimed_at = NULL
         WHERE message = $1
         """,
         message,
+        tags=claim_tags(message, channel, tile),
     )
 
 
+async def get_capture_by_message(message: int) -> TileCapture or None:
+    # Flushed before taking a connection, see BatchQueue.flush
+    await claims_queue.flush_for(("message", message))
+    return await _get_capture_by_message(message)
+
+
 @postgres
-async def get_capture_by_message(message: int, conn=None) -> TileCapture or None:
+async def _get_capture_by_message(message: int, conn=None) -> TileCapture or None:
     payload = await conn.fetch(
         """SELECT * FROM claims WHERE message=$1""",
         message,
@@ -204,26 +270,142 @@ async def get_capture_by_message(message: int, conn=None) -> TileCapture or None
 @postgres
 async def get_tile_claims(tile: str, channel: int, event: int = 0, conn=None) -> list[TileCapture]:
     if event == 0:
-        event_start, event_end = bloons.get_current_ct_period()
-    else:
-        event_start, event_end = bloons.get_ct_period_during(event=event)
+        event = bloons.get_ct_number_during(datetime.datetime.now())
+    event_start, event_end = bloons.get_ct_period_during(event=event)
+    part_start, part_end = claims_partition_range(event)
     tiles = await conn.fetch("""
         SELECT * FROM claims
         WHERE channel=$1
           AND tile=$2
           AND claimed_at >= $3
           AND claimed_at <= $4
+          AND called_at >= $5
+          AND called_at < $6
         ORDER BY claimed_at ASC
-    """, channel, tile, event_start, event_end)
+    """, channel, tile, event_start, event_end, part_start, part_end)
     return [TileCapture(r["userid"], tile, channel, r["message"], r["claimed_at"]) for r in tiles]
 
 
+@postgres
+async def backfill_claims(
+        channel: int,
+        claims: list[tuple[int, str, int, datetime.datetime, datetime.datetime | None]],
+        conn=None
+) -> None:
+    """
+    Adds claims recovered from a channel's history in one transaction. Messages that are
+    already registered are left alone, except uncaptured ones that turn out to be captured.
+    :param channel: The tracked channel.
+    :param claims: Tuples of (user, tile, message, called_at, claimed_at).
+    """
+    if len(claims) == 0:
+        return
+    users, tiles, messages, called_ats, claimed_ats = zip(*claims)
+    async with conn.transaction():
+        await lock_keys(list(messages), conn)
+        await conn.execute(
+            """
+            WITH backfill AS (
+                SELECT *
+                FROM UNNEST($2::BIGINT[], $3::VARCHAR(3)[], $4::BIGINT[], $5::TIMESTAMP[], $6::TIMESTAMP[])
+                    AS b(userid, tile, message, called_at, claimed_at)
+            ), captured AS (
+                UPDATE claims c
+                SET claimed_at = b.claimed_at
+                FROM backfill b
+                WHERE c.message = b.message
+                    AND c.claimed_at IS NULL
+                    AND b.claimed_at IS NOT NULL
+                RETURNING c.message
+            )
+            INSERT INTO claims (userid, tile, channel, message, called_at, claimed_at)
+            SELECT b.userid, b.tile, $1, b.message, b.called_at, b.claimed_at
+            FROM backfill b
+            WHERE NOT EXISTS (SELECT 1 FROM claims c WHERE c.message = b.message)
+            """,
+            channel, list(users), list(tiles), list(messages), list(called_ats), list(claimed_ats),
+        )
+
+
+def claims_partition_range(event: int) -> tuple[datetime.datetime, datetime.datetime]:
+    """
+    The called_at range of an event's claims partition. It starts when the previous
+    event ends, so calls made during the break before an event belong to that event.
+    """
+    _ps, start = bloons.get_ct_period_during(event=event-1) if event > 1 else (None, datetime.datetime.fromtimestamp(0))
+    _es, end = bloons.get_ct_period_during(event=event)
+    return start, end
+
+
+@postgres
+async def create_claims_partition(event: int, conn=None) -> None:
+    """
+    Creates the claims partition for an event, if it doesn't exist yet. Only meant for events
+    whose range hasn't started, so no claims in the default partition belong to it.
+    A constraint proving that is validated beforehand, which doesn't block writes, so creating
+    the partition doesn't have to scan the default partition while holding a lock on it.
+    """
+    exists = await conn.fetchval("SELECT COUNT(*) > 0 FROM claims_partitions WHERE event = $1", event)
+    if exists:
+        return
+
+    name = f"claims_ct{event}"
+    starts_at, ends_at = claims_partition_range(event)
+    check_name = f"claims_default_before_ct{event}"
+    await conn.execute(f"ALTER TABLE claims_default DROP CONSTRAINT IF EXISTS {check_name}")
+    await conn.execute(f"""
+        ALTER TABLE claims_default ADD CONSTRAINT {check_name}
+            CHECK (called_at < '{starts_at}') NOT VALID
+    """)
+    try:
+        await conn.execute(f"ALTER TABLE claims_default VALIDATE CONSTRAINT {check_name}")
+        async with conn.transaction():
+            await conn.execute(f"""
+                CREATE TABLE {name} PARTITION OF claims
+                    FOR VALUES FROM ('{starts_at}') TO ('{ends_at}')
+            """)
+            await conn.execute("""
+                INSERT INTO claims_partitions (event, name, starts_at, ends_at)
+                VALUES ($1, $2, $3, $4)
+            """, event, name, starts_at, ends_at)
+    finally:
+        # Calls past the newest partition still have to fit in the default one
+        await conn.execute(f"ALTER TABLE claims_default DROP CONSTRAINT IF EXISTS {check_name}")
+
+
+async def ensure_claims_partitions() -> None:
+    """
+    Makes sure the current and next events have their own claims partition, as long as
+    their range hasn't started yet. Claims of an event that's already underway stay in
+    the default partition, so they never have to be moved.
+    """
+    current = bloons.get_current_ct_number()
+    now = datetime.datetime.now()
+    for event in [current, current+1]:
+        starts_at, _ends_at = claims_partition_range(event)
+        if starts_at > now:
+            await create_claims_partition(event)
+
+
 @postgres
 async def purge_old_tickets(conn=None) -> None:
+    # Anonymize whole event partitions once they're old enough, and only once
+    to_anonymize = await conn.fetch("""
+        SELECT event, name
+        FROM claims_partitions
+        WHERE anonymized_at IS NULL
+            AND ends_at <= NOW() - MAKE_INTERVAL(days => 30)
+    """)
+    for row in to_anonymize:
+        async with conn.transaction():
+            await conn.execute(f"UPDATE {row['name']} SET tile='???'")
+            await conn.execute("UPDATE claims_partitions SET anonymized_at = NOW() WHERE event = $1", row["event"])
+
     await conn.execute(
         """
-        UPDATE claims
+        UPDATE claims_default
         SET tile='???'
         WHERE called_at <= NOW() - MAKE_INTERVAL(days => 30)
+            AND tile != '???'
         """
     )
@@ -0,0 +1,38 @@
+import asyncio
+
+
+class AdaptiveLimiter:
+    """
+    Caps how many requests are in flight at once, adapting to how the upstream is doing.
+    The cap goes up by one after every `grow_after` successes in a row and is halved
+    after a failure.
+    """
+    def __init__(self, start: int = 5, minimum: int = 1, maximum: int = 20, grow_after: int = 5):
+        self.limit = start
+        self.minimum = minimum
+        self.maximum = maximum
+        self.grow_after = grow_after
+        self._in_flight = 0
+        self._streak = 0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self) -> "AdaptiveLimiter":
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        return self
+
+    async def __aexit__(self, *_exc) -> None:
+        async with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def success(self) -> None:
+        self._streak += 1
+        if self._streak >= self.grow_after:
+            self.limit = min(self.limit + 1, self.maximum)
+            self._streak = 0
+
+    def failure(self) -> None:
+        self.limit = max(self.limit // 2, self.minimum)
+        self._streak = 0
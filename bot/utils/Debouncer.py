@@ -0,0 +1,52 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable
+
+
+class Debouncer:
+    """
+    Coalesces calls to an async function, separately for each key it's called with.
+    Calls made within `delay` of each other run it only once, and there's never more than
+    one run in flight for a key. A call made while a run is in flight gets a fresh run
+    right after it, so the latest state is always the one that ends up being used.
+    """
+    def __init__(self, func: Callable[[Hashable], Awaitable[None]], delay: float = 1.5):
+        self.func = func
+        self.delay = delay
+        self._pending: dict[Hashable, asyncio.Future] = {}  # Runs that haven't started yet
+        self._locks: dict[Hashable, asyncio.Lock] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def __call__(self, key: Hashable) -> None:
+        """Requests a run for a key and waits until a run that started after the request is over."""
+        if key not in self._pending:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[key] = future
+            task = asyncio.create_task(self._run(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            task.add_done_callback(lambda _t: self._release(key, future))
+        await asyncio.shield(self._pending[key])
+
+    async def _run(self, key: Hashable) -> None:
+        future = self._pending[key]
+        await asyncio.sleep(self.delay)
+        if key not in self._locks:
+            self._locks[key] = asyncio.Lock()
+        async with self._locks[key]:
+            # From here on, new calls have to wait for the next run
+            del self._pending[key]
+            try:
+                await self.func(key)
+                future.set_result(None)
+            except Exception as exc:
+                future.set_exception(exc)
+
+    def _release(self, key: Hashable, future: asyncio.Future) -> None:
+        """
+        Runs once a run's task is over, however it ended. If it was cancelled, even before
+        it got to start, its callers are cancelled too and the next call schedules a new run.
+        """
+        if self._pending.get(key) is future:
+            del self._pending[key]
+        if not future.done():
+            future.cancel()
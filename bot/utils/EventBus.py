@@ -0,0 +1,107 @@
+import io
+import time
+import asyncio
+import traceback
+from dataclasses import dataclass
+from types import EllipsisType
+from typing import Any, Awaitable, Callable, Literal
+from .colors import purple, red
+
+Event = Literal[
+    "on_tile_started",  # (tile: str, claim_channel: int, message: discord.Message)
+    "on_tile_captured",  # (tile: str, claim_channel: int, claimer: int)
+    "on_tile_uncaptured",  # (tile: str, claim_channel: int, claimer: int)
+]
+Handler = Callable[..., Awaitable[None]]
+
+
+@dataclass
+class EventStats:
+    dispatched: int = 0
+    errors: int = 0
+    slow: int = 0  #: Handlers that went over their timeout
+    total_time: float = 0.0  #: Seconds spent dispatching, summed over every dispatch
+    max_time: float = 0.0
+
+    @property
+    def avg_time(self) -> float:
+        return self.total_time / self.dispatched if self.dispatched else 0.0
+
+
+class EventBus:
+    """
+    Dispatches events between cogs. Every handler of an event runs concurrently and is
+    isolated from the others: one raising or being slow doesn't affect the rest.
+    Handlers are never cancelled, since most of them have side effects that shouldn't be
+    left halfway done. Publishing stops waiting for one once it goes over its timeout,
+    and it's logged as slow.
+    """
+    def __init__(self, timeout: float | None = 15):
+        self.timeout = timeout  #: Default timeout of handlers, None to always wait for them
+        self.handlers: dict[Event, list[Handler]] = {}
+        self.timeouts: dict[tuple[Event, Handler], float | None] = {}
+        self.stats: dict[Event, EventStats] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def subscribe(self, event: Event, handler: Handler, timeout: float | None | EllipsisType = ...) -> None:
+        """
+        :param timeout: How long publishing waits for the handler, None to always wait for it.
+                        Defaults to the bus' timeout.
+        """
+        if event not in self.handlers:
+            self.handlers[event] = []
+        if handler not in self.handlers[event]:
+            self.handlers[event].append(handler)
+        self.timeouts[(event, handler)] = self.timeout if timeout is ... else timeout
+
+    def unsubscribe(self, event: Event, handler: Handler) -> None:
+        if event in self.handlers and handler in self.handlers[event]:
+            self.handlers[event].remove(handler)
+        self.timeouts.pop((event, handler), None)
+
+    async def publish(self, event: Event, *args: Any, **kwargs: Any) -> None:
+        """Runs every handler of an event and waits for all of them to be done or go over their timeout."""
+        handlers = self.handlers.get(event, [])
+        if len(handlers) == 0:
+            return
+        if event not in self.stats:
+            self.stats[event] = EventStats()
+        stats = self.stats[event]
+
+        start = time.perf_counter()
+        await asyncio.gather(*[self._run_handler(event, handler, stats, *args, **kwargs) for handler in handlers])
+        elapsed = time.perf_counter() - start
+        stats.dispatched += 1
+        stats.total_time += elapsed
+        stats.max_time = max(stats.max_time, elapsed)
+
+    def emit(self, event: Event, *args: Any, **kwargs: Any) -> asyncio.Task:
+        """Same as publish, without waiting for the handlers."""
+        task = asyncio.create_task(self.publish(event, *args, **kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run_handler(self, event: Event, handler: Handler, stats: EventStats, *args: Any, **kwargs: Any) -> None:
+        task = asyncio.create_task(handler(*args, **kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(lambda t: self._check_handler(event, handler, stats, t))
+
+        timeout = self.timeouts.get((event, handler), self.timeout)
+        # Waiting doesn't cancel the handler, neither on timeout nor if publish itself is cancelled
+        done, _pending = await asyncio.wait({task}, timeout=timeout)
+        if len(done) == 0:
+            stats.slow += 1
+            print(f"{purple('[Events]')} "
+                  f"{red(f'{handler.__qualname__} is taking over {timeout}s handling {event}, not waiting for it')}")
+
+    @staticmethod
+    def _check_handler(event: Event, handler: Handler, stats: EventStats, task: asyncio.Task) -> None:
+        if task.cancelled() or (exc := task.exception()) is None:
+            return
+        stats.errors += 1
+        str_traceback = io.StringIO()
+        traceback.print_exception(exc, file=str_traceback)
+        print(f"{purple('[Events]')} {red(f'{handler.__qualname__} failed handling {event}')}\n"
+              f"{str_traceback.getvalue().rstrip()}")
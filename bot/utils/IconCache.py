@@ -0,0 +1,84 @@
+import os
+import json
+import aiofiles
+from collections import OrderedDict
+from datetime import datetime
+from config import DATA_PATH
+
+
+class IconCache:
+    """
+    On-disk cache of composed team icons, keyed by icon hash and format.
+    A manifest keeps track of every file's size and last use, so lookups never have to touch
+    the disk. Once the cache goes over its size budget, the least recently used files are evicted.
+    """
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(path, "manifest.json")
+        self._entries: OrderedDict[str, dict[str, int | float]] | None = None  # Least recently used first
+        self._size = 0
+
+    @staticmethod
+    def key(icon_hash: str, animated: bool) -> str:
+        return f"{icon_hash}.{'gif' if animated else 'png'}"
+
+    @property
+    def entries(self) -> OrderedDict[str, dict[str, int | float]]:
+        if self._entries is None:
+            self._load()
+        return self._entries
+
+    def _load(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        entries = []
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as fin:
+                entries = json.load(fin)
+        # Files removed by hand are only checked for once, here
+        entries = [e for e in entries if os.path.exists(os.path.join(self.path, e["key"]))]
+        entries.sort(key=lambda e: e["last_used"])
+        self._entries = OrderedDict((e["key"], {"size": e["size"], "last_used": e["last_used"]}) for e in entries)
+        self._size = sum(e["size"] for e in self._entries.values())
+
+    def get(self, icon_hash: str, animated: bool) -> str | None:
+        """Returns the path to a cached icon, or None if it's not cached."""
+        key = self.key(icon_hash, animated)
+        if key not in self.entries:
+            return None
+        self.entries[key]["last_used"] = datetime.now().timestamp()
+        self.entries.move_to_end(key)
+        return os.path.join(self.path, key)
+
+    async def put(self, icon_hash: str, animated: bool, file_path: str) -> str:
+        """
+        Moves a composed icon into the cache.
+        :return: Its path in the cache.
+        """
+        key = self.key(icon_hash, animated)
+        cached_path = os.path.join(self.path, key)
+        if key in self.entries:
+            self._size -= self.entries.pop(key)["size"]
+        os.replace(file_path, cached_path)
+        size = os.path.getsize(cached_path)
+        self.entries[key] = {"size": size, "last_used": datetime.now().timestamp()}
+        self._size += size
+
+        while self._size > self.max_bytes and len(self.entries) > 1:
+            old_key, old_entry = self.entries.popitem(last=False)
+            self._size -= old_entry["size"]
+            try:
+                os.remove(os.path.join(self.path, old_key))
+            except FileNotFoundError:
+                pass
+
+        await self.save()
+        return cached_path
+
+    async def save(self) -> None:
+        data = json.dumps([{"key": key, **entry} for key, entry in self.entries.items()])
+        async with aiofiles.open(self.manifest_path, "w") as fout:
+            await fout.write(data)
+
+
+team_icon_cache = IconCache(os.path.join(DATA_PATH, "team_icons"))
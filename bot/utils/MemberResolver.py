@@ -0,0 +1,81 @@
+import asyncio
+import discord
+from datetime import timedelta
+from .Cache import Cache
+from .colors import purple, red
+
+
+class MemberResolver:
+    """
+    Resolves guild members in bulk. Members missing from the client cache are requested
+    through the gateway 100 at a time instead of with one REST call each.
+    """
+    CHUNK_SIZE = 100
+
+    def __init__(self, name_ttl: timedelta = timedelta(minutes=30)):
+        self.name_ttl = name_ttl
+        self._names: dict[int, dict[int, Cache]] = {}
+
+    async def get_members(self, guild: discord.Guild, user_ids: list[int]) -> dict[int, discord.Member]:
+        """
+        Gets members of a guild. Users who aren't in the guild anymore are left out, and so
+        are users whose chunk couldn't be queried.
+        :param guild: The guild.
+        :param user_ids: The IDs of the users.
+        :return: The members, keyed by ID.
+        """
+        members = {}
+        missing = []
+        for uid in set(user_ids):
+            if (member := guild.get_member(uid)) is not None:
+                members[uid] = member
+            else:
+                missing.append(uid)
+
+        for i in range(0, len(missing), self.CHUNK_SIZE):
+            try:
+                chunk = await guild.query_members(
+                    user_ids=missing[i:i+self.CHUNK_SIZE],
+                    limit=self.CHUNK_SIZE,
+                    cache=True,
+                )
+            except (asyncio.TimeoutError, discord.ClientException) as exc:
+                # Same as if they weren't in the guild, the other chunks can still be resolved
+                print(f"{purple('[MemberResolver]')} {red(f'Could not query members of {guild.id}: {exc!r}')}")
+                continue
+            for member in chunk:
+                members[member.id] = member
+
+        for member in members.values():
+            self._cache_name(guild.id, member)
+        return members
+
+    async def get_member(self, guild: discord.Guild, user_id: int) -> discord.Member | None:
+        return (await self.get_members(guild, [user_id])).get(user_id)
+
+    async def get_display_names(self, guild: discord.Guild, user_ids: list[int]) -> dict[int, str]:
+        """
+        Gets the display names of members of a guild, from cache if possible.
+        Users who aren't in the guild anymore are left out.
+        """
+        names = {}
+        to_resolve = []
+        guild_names = self._names.get(guild.id, {})
+        for uid in set(user_ids):
+            if uid in guild_names and guild_names[uid].valid:
+                names[uid] = guild_names[uid].value
+            else:
+                to_resolve.append(uid)
+
+        members = await self.get_members(guild, to_resolve)
+        for uid in members:
+            names[uid] = members[uid].display_name
+        return names
+
+    def _cache_name(self, guild_id: int, member: discord.Member) -> None:
+        if guild_id not in self._names:
+            self._names[guild_id] = {}
+        self._names[guild_id][member.id] = Cache(member.display_name, self.name_ttl)
+
+
+member_resolver = MemberResolver()
@@ -0,0 +1,61 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+
+@dataclass
+class CachedMessage:
+    id: int
+    author_id: int
+    tile: str | None  #: Tile code found in the message, if any
+    reactions: dict[str, int] = field(default_factory=dict)  #: Count of every tracked reaction
+
+    @property
+    def has_reactions(self) -> bool:
+        return any(count > 0 for count in self.reactions.values())
+
+    def add_reaction(self, emoji: str) -> None:
+        self.reactions[emoji] = self.reactions.get(emoji, 0) + 1
+
+    def remove_reaction(self, emoji: str) -> None:
+        self.reactions[emoji] = max(self.reactions.get(emoji, 0) - 1, 0)
+
+    def clear_reactions(self, emoji: str | None = None) -> None:
+        """Resets the count of an emoji, or of every emoji if none is given."""
+        if emoji is None:
+            self.reactions.clear()
+        else:
+            self.reactions.pop(emoji, None)
+
+
+class RecentMessageCache:
+    """
+    Keeps the last few messages of each channel in memory, evicting the least
+    recently used ones first.
+    """
+    def __init__(self, per_channel: int = 250):
+        self.per_channel = per_channel
+        self._channels: dict[int, OrderedDict[int, CachedMessage]] = {}
+
+    def get(self, channel_id: int, message_id: int) -> CachedMessage | None:
+        channel = self._channels.get(channel_id)
+        if channel is None or message_id not in channel:
+            return None
+        channel.move_to_end(message_id)
+        return channel[message_id]
+
+    def put(self, channel_id: int, message: CachedMessage) -> CachedMessage:
+        if channel_id not in self._channels:
+            self._channels[channel_id] = OrderedDict()
+        channel = self._channels[channel_id]
+        channel[message.id] = message
+        channel.move_to_end(message.id)
+        while len(channel) > self.per_channel:
+            channel.popitem(last=False)
+        return message
+
+    def remove(self, channel_id: int, message_id: int) -> None:
+        if channel_id in self._channels:
+            self._channels[channel_id].pop(message_id, None)
+
+    def remove_channel(self, channel_id: int) -> None:
+        self._channels.pop(channel_id, None)
@@ -1,15 +1,57 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from dataclasses import dataclass, field
 import os
 import asyncio
 import aiofiles
 import aiohttp_client_cache
 import aiohttp
 from bloonspy import AsyncClient, btd6
+from bloonspy.model.btd6 import Relic
 from config import DATA_PATH
+from .Cache import Cache
+from .bloons import get_ct_period_during, get_current_ct_number
+from .emojis import TILE_BANNER, TILE_RELIC, TILE_REGULAR, RELICS
 import json
 
+
+@dataclass(frozen=True)
+class CtTileIndex:
+    event_id: str | None
+    codes: frozenset[str]
+    tiles: dict[str, btd6.CtTile]
+    banners: frozenset[str] = frozenset()  #: Codes of the banner tiles
+    relics: dict[str, Relic] = field(default_factory=dict)  #: Relic of each relic tile
+    emojis: dict[str, str] = field(default_factory=dict)  #: Emoji of each tile's type or relic
+
+    @staticmethod
+    def from_tiles(event_id: str, tiles: list[btd6.CtTile]) -> "CtTileIndex":
+        banners = frozenset(t.id for t in tiles if t.tile_type == btd6.CtTileType.BANNER)
+        relics = {t.id: t.relic for t in tiles if t.tile_type == btd6.CtTileType.RELIC}
+        emojis = {}
+        for t in tiles:
+            if t.id in banners:
+                emojis[t.id] = TILE_BANNER
+            elif t.id in relics:
+                emojis[t.id] = RELICS.get(relics[t.id], TILE_RELIC)
+            else:
+                emojis[t.id] = TILE_REGULAR
+        return CtTileIndex(
+            event_id,
+            frozenset(t.id for t in tiles),
+            {t.id: t for t in tiles},
+            banners,
+            relics,
+            emojis,
+        )
+
+
 bpy_client: AsyncClient
 files_dir = os.path.join(os.getcwd(), "files")
+# Rebuilt only when the current CT event changes. Between checks, tile lookups don't touch the API at all.
+TILE_INDEX_RECHECK = timedelta(minutes=10)
+tile_index = CtTileIndex(None, frozenset(), {})
+tile_index_check = Cache.empty()
+tile_index_lock = asyncio.Lock()
 
 
 async def init_bloonspy_client() -> None:
@@ -50,8 +92,31 @@ async def get_current_ct_tiles() -> list[btd6.CtTile]:
     return await ct.tiles()
 
 
+async def get_current_tile_index() -> CtTileIndex:
+    """Returns an index of the current event's tiles, keyed by tile code, along with how each one is classified."""
+    global tile_index, tile_index_check
+    if tile_index_check.valid:
+        return tile_index
+
+    async with tile_index_lock:
+        if tile_index_check.valid:
+            return tile_index
+        ct = await get_current_ct_event()
+        # Never keep an index past the next event's start, tiles are called right at reset
+        next_start, _ne = get_ct_period_during(event=get_current_ct_number()+1)
+        recheck_at = min(datetime.now() + TILE_INDEX_RECHECK, next_start)
+        if ct is None:
+            tile_index = CtTileIndex(None, frozenset(), {})
+        elif ct.id != tile_index.event_id:
+            tiles = await ct.tiles()
+            # Swapped in one assignment so readers never see a half-built index
+            tile_index = CtTileIndex.from_tiles(ct.id, tiles)
+        tile_index_check = Cache(True, recheck_at)
+    return tile_index
+
+
 async def is_tile_code_valid(tile: str) -> bool:
-    return tile in [t.id for t in await get_current_ct_tiles()]
+    return tile in (await get_current_tile_index()).codes
 
 
 async def fetch_tile_data(tile: str) -> dict | None:
@@ -44,6 +44,8 @@ COLOR_STYLES = {
 
 TILE_OVERLAY_PATH = os.path.join("files", "bin", "tile_overlays")
 TILE_OVERLAY_SIZE = round(max(HEX_RADIUS) * 10/8)
+# Every overlay, converted & resized once. Keyed by file name without extension.
+tile_overlays: dict[str, Image.Image] | None = None
 
 TEXT_FONT = ImageFont.truetype(os.path.join("files", "bin", "LuckiestGuy-Regular.ttf"), (max(HEX_RADIUS) * 10) // 8)
 text_margin_rel = round(max(HEX_RADIUS) * 3/8)
@@ -296,26 +298,40 @@ def draw_hexagon(
         )
 
 
-def paste_relic(
-        relic: btd6.Relic,
+def load_tile_overlays() -> dict[str, Image.Image]:
+    global tile_overlays
+    if tile_overlays is None:
+        overlays = {}
+        for fname in os.listdir(TILE_OVERLAY_PATH):
+            if not fname.endswith(".png"):
+                continue
+            with Image.open(os.path.join(TILE_OVERLAY_PATH, fname)) as overlay:
+                overlays[fname[:-4].lower()] = overlay.convert("RGBA").resize((TILE_OVERLAY_SIZE, TILE_OVERLAY_SIZE))
+        tile_overlays = overlays
+    return tile_overlays
+
+
+def paste_overlay(
+        name: str,
         qrs: tuple[int, int, int],
         image: Image,
         map_center: tuple[int, int]) -> None:
     xy = qrs_to_xy(qrs, map_center)
     xy = (xy[0]-int(TILE_OVERLAY_SIZE/2), xy[1]-int(TILE_OVERLAY_SIZE/2))
-    relic_img = Image.open(os.path.join(TILE_OVERLAY_PATH, f"{relic.value.replace(' ', '')}.png").lower()) \
-                     .convert("RGBA") \
-                     .resize((TILE_OVERLAY_SIZE, TILE_OVERLAY_SIZE))
-    Image.Image.paste(image, relic_img, xy, mask=relic_img)
+    overlay = load_tile_overlays()[name]
+    Image.Image.paste(image, overlay, xy, mask=overlay)
+
+
+def paste_relic(
+        relic: btd6.Relic,
+        qrs: tuple[int, int, int],
+        image: Image,
+        map_center: tuple[int, int]) -> None:
+    paste_overlay(relic.value.replace(' ', '').lower(), qrs, image, map_center)
 
 
 def paste_banner(
         qrs: tuple[int, int, int],
         image: Image,
         map_center: tuple[int, int]) -> None:
-    xy = qrs_to_xy(qrs, map_center)
-    xy = (xy[0]-int(TILE_OVERLAY_SIZE/2), xy[1]-int(TILE_OVERLAY_SIZE/2))
-    relic_img = Image.open(os.path.join(TILE_OVERLAY_PATH, "banner.png")) \
-                    .convert("RGBA") \
-                    .resize((TILE_OVERLAY_SIZE, TILE_OVERLAY_SIZE))
-    Image.Image.paste(image, relic_img, xy, mask=relic_img)
+    paste_overlay("banner", qrs, image, map_center)
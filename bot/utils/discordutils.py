@@ -4,12 +4,69 @@ import aiohttp
 import aiofiles
 import asyncio
 import io
+import json
+import hashlib
 import traceback
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from discord.ext import commands
 import discord.errors
 
 
+@dataclass
+class ChannelFingerprint:
+    message_ids: list[int]  #: The bot's messages in the channel, oldest first
+    hashes: list[str]  #: Fingerprint of what each message currently shows
+
+
+# What update_messages last left in each channel
+message_fingerprints: dict[int, ChannelFingerprint] = {}
+
+
+def fingerprint(content: str, view: discord.ui.View or None) -> str:
+    """Hashes a message's content along with the layout of its view."""
+    components = view.to_components() if view is not None else []
+    payload = json.dumps([content, components], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+async def update_messages_from_fingerprint(
+        content: list[tuple[str, discord.ui.View or None]],
+        hashes: list[str],
+        channel: discord.TextChannel,
+        resend: bool,
+        allowed_mentions: discord.AllowedMentions,
+) -> bool:
+    """Edits only the messages whose fingerprint changed, without reading the channel's history.
+    Only possible if the bot's messages are still the last ones in the channel.
+
+    :return: False if the channel must be checked the long way instead.
+    """
+    fp = message_fingerprints.get(channel.id)
+    if fp is None or len(fp.message_ids) != len(content) or channel.last_message_id != fp.message_ids[-1]:
+        return False
+    if resend and discord.utils.snowflake_time(fp.message_ids[0]) < discord.utils.utcnow() - timedelta(hours=1):
+        return False
+
+    coros = []
+    for i in range(len(content)):
+        if hashes[i] == fp.hashes[i]:
+            continue
+        new_content, new_view = content[i]
+        coros.append(channel.get_partial_message(fp.message_ids[i]).edit(
+            content=new_content,
+            view=new_view if new_view is not None else discord.ui.View(),
+            allowed_mentions=allowed_mentions,
+        ))
+    try:
+        await asyncio.gather(*coros)
+    except discord.NotFound:
+        message_fingerprints.pop(channel.id, None)
+        return False
+    fp.hashes = hashes
+    return True
+
+
 async def update_messages(
         bot: discord.ClientUser,
         content: list[tuple[str, discord.ui.View or None]],
@@ -35,6 +92,10 @@ async def update_messages(
     :param allowed_mentions: Allowed mentions for the send command.
     :param silent: If it resends the message, toggle if it's silent.
     """
+    hashes = [fingerprint(msg, view) for msg, view in content]
+    if await update_messages_from_fingerprint(content, hashes, channel, resend, allowed_mentions):
+        return
+
     messages_to_change = []
     bot_messages = []
     user_messages_delete = []
@@ -64,18 +125,22 @@ async def update_messages(
     if len(messages_to_change) != len(content):
         modify = False
 
+    old_fp = message_fingerprints.pop(channel.id, None)
+    known_hashes = dict(zip(old_fp.message_ids, old_fp.hashes)) if old_fp else {}
     if modify:
         coros = [m.delete() for m in user_messages_delete]
         for i in range(len(content)):
             new_content, new_view = content[i]
             if new_view is None:
                 new_view = discord.ui.View()
+            if known_hashes.get(messages_to_change[i].id) == hashes[i]:
+                continue
             if messages_to_change[i].content != new_content or not \
                     (len(messages_to_change[i].components) == len(new_view.to_components()) == 0):
-                await messages_to_change[i].edit(content=new_content, view=new_view, allowed_mentions=allowed_mentions)
-                #coros.append(messages_to_change[i].edit(content=new_content, view=new_view, allowed_mentions=allowed_mentions))
+                coros.append(messages_to_change[i].edit(content=new_content, view=new_view, allowed_mentions=allowed_mentions))
 
         await asyncio.gather(*coros)
+        message_fingerprints[channel.id] = ChannelFingerprint([m.id for m in messages_to_change], hashes)
         return
 
     coros = []
@@ -83,13 +148,15 @@ async def update_messages(
         coros.append(msg.delete())
     await asyncio.gather(*coros, return_exceptions=True)
 
+    sent = []
     for msg, view in content:
-        await channel.send(
+        sent.append(await channel.send(
             content=msg,
             view=view,
             allowed_mentions=allowed_mentions,
             silent=silent,
-        )
+        ))
+    message_fingerprints[channel.id] = ChannelFingerprint([m.id for m in sent], hashes)
 
 
 def gatekeep():
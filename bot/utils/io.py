@@ -45,27 +45,30 @@ def merge_images(img1_path: str, img2_path: str, save_path: str, gif: bool) -> b
     img1.paste(img2, (0, 0), img2)
     
     if gif:
-        frame2 = img1.copy()
-        pixels = frame2.load()
-        # This is so the frames are a little different, but ALSO you can't add new colors
-        # because for some reason sometimes GIFs flicker if you do.
-        replaced = False
-        for i in range(frame2.size[0]):
-            for j in range(frame2.size[1]):
-                if pixels[i, j][3] == 255:
-                    # Make a square. Changing only one pixel sometimes
-                    # doesn't work due to compression or... something
-                    SQUARE_SIZE = 6
-                    for x in range(SQUARE_SIZE):
-                        for y in range(SQUARE_SIZE):
-                            pixels[x, y] = pixels[i, j]
-                    replaced = True
-                    break
-            if replaced:
-                break
+        frame2 = vary_frame(img1)
         frames = [img1, frame2]
         img1.save(save_path, format="GIF", append_images=frames, save_all=True, duration=100, loop=0)
     else:
         img1.save(save_path)
 
     return True
+
+
+def vary_frame(img: Image.Image) -> Image.Image:
+    """Copies an RGBA image, painting its top-left corner with the color of its first opaque pixel
+    (going column by column).
+    """
+    # This is so the frames are a little different, but ALSO you can't add new colors
+    # because for some reason sometimes GIFs flicker if you do.
+    frame = img.copy()
+    opaque = frame.getchannel("A").point(lambda a: 255 if a == 255 else 0)
+    bbox = opaque.getbbox()
+    if bbox is None:
+        return frame
+    x = bbox[0]
+    y = opaque.crop((x, 0, x+1, frame.size[1])).getbbox()[1]
+    # Make a square. Changing only one pixel sometimes
+    # doesn't work due to compression or... something
+    SQUARE_SIZE = 6
+    frame.paste(frame.getpixel((x, y)), (0, 0, SQUARE_SIZE, SQUARE_SIZE))
+    return frame
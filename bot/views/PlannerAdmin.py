@@ -200,6 +200,7 @@ class PlannerAdminView(discord.ui.View):
     def __init__(self,
                  planner_channel_id: int,
                  refresh_planner: RefreshPlannerCallback,
+                 reschedule_decays: RefreshPlannerCallback,
                  edit_time: EditTimeCallback,
                  force_unclaim: TileSelectCallback,
                  add_planner_tile: AddTileCallback,
@@ -209,6 +210,7 @@ class PlannerAdminView(discord.ui.View):
         super().__init__(timeout=timeout)
         self.planner_id = planner_channel_id
         self.refresh_planner = refresh_planner
+        self.reschedule_decays = reschedule_decays
         self.add_item(
             SwitchPlannerButton(self.switch_planner, planner_active, self.planner_id)
         )
@@ -232,6 +234,7 @@ class PlannerAdminView(discord.ui.View):
 
     async def clear_planner(self, interaction: discord.Interaction):
         await bot.db.queries.planner.set_clear_time(self.planner_id, datetime.now())
+        await self.reschedule_decays(self.planner_id)
         await interaction.response.send_message(
             content=f"Cleared the planner!",
             ephemeral=True
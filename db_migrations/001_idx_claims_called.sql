@@ -0,0 +1,4 @@
+-- is_tile_called: uncaptured calls of a tile in a channel within a called_at window
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_claims_called
+    ON claims (channel, tile, called_at)
+    WHERE claimed_at IS NULL;
@@ -0,0 +1,4 @@
+-- get_tile_claims & get_tile_closest_to_expire: captures of a tile in a channel, by capture time
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_claims_captured
+    ON claims (channel, tile, claimed_at)
+    WHERE claimed_at IS NOT NULL;
@@ -0,0 +1,3 @@
+-- get_ticket_overview: only needs the claimer & capture time of a channel's claims
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_claims_channel_claimed_at
+    ON claims (channel, claimed_at) INCLUDE (userid);
@@ -0,0 +1,6 @@
+-- First step of partitioning claims on called_at, which can't be NULL in the partition key.
+-- Only rows from before called_at had a default are updated, and they're only row-locked.
+-- The constraint is added as NOT VALID so it doesn't scan the table while holding a lock on it.
+UPDATE claims SET called_at = COALESCE(claimed_at, NOW()) WHERE called_at IS NULL;
+
+ALTER TABLE claims ADD CONSTRAINT claims_called_at_not_null CHECK (called_at IS NOT NULL) NOT VALID;
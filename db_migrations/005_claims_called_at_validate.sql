@@ -0,0 +1,3 @@
+-- Validating only takes a SHARE UPDATE EXCLUSIVE lock, so claims can still be written meanwhile.
+-- With this constraint in place, 007 can set called_at NOT NULL without scanning the table.
+ALTER TABLE claims VALIDATE CONSTRAINT claims_called_at_not_null;
@@ -0,0 +1,4 @@
+-- The partitioned claims table's primary key has to include called_at. Built ahead of time
+-- so 007 can turn it into the existing table's primary key without locking it for the build.
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_claims_message_called_at
+    ON claims (message, called_at);
@@ -0,0 +1,56 @@
+-- Turns claims into a table range-partitioned on called_at. Nothing is copied: the existing
+-- table becomes the default partition as is, and every statement here only changes the catalog.
+-- Partitions lining up with CT events are created ahead of time by
+-- bot.db.queries.tickets.ensure_claims_partitions.
+
+-- Uses the constraint validated in 005 instead of scanning the table
+ALTER TABLE claims ALTER COLUMN called_at SET NOT NULL;
+ALTER TABLE claims DROP CONSTRAINT claims_called_at_not_null;
+
+ALTER TABLE claims DROP CONSTRAINT claims_pkey;
+ALTER TABLE claims ADD CONSTRAINT claims_default_pkey PRIMARY KEY USING INDEX idx_claims_message_called_at;
+
+ALTER TABLE claims RENAME TO claims_default;
+ALTER INDEX idx_claims_called RENAME TO claims_default_called_idx;
+ALTER INDEX idx_claims_captured RENAME TO claims_default_captured_idx;
+ALTER INDEX idx_claims_channel_claimed_at RENAME TO claims_default_channel_claimed_at_idx;
+
+-- The partition key has to be part of the primary key
+CREATE TABLE claims (
+    userid BIGINT NOT NULL,
+    tile VARCHAR(3) NOT NULL,
+    channel BIGINT NOT NULL,
+    message BIGINT NOT NULL,
+    claimed_at TIMESTAMP,
+    called_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (message, called_at)
+) PARTITION BY RANGE (called_at);
+
+ALTER TABLE claims ADD CONSTRAINT fk_teams_1
+    FOREIGN KEY (channel) REFERENCES teams(channel) ON DELETE CASCADE;
+
+-- Same indexes as 001-003. The parent has no partitions yet so these are instant,
+-- and attaching claims_default reuses its matching indexes instead of building new ones.
+CREATE INDEX idx_claims_called
+    ON claims (channel, tile, called_at)
+    WHERE claimed_at IS NULL;
+
+CREATE INDEX idx_claims_captured
+    ON claims (channel, tile, claimed_at)
+    WHERE claimed_at IS NOT NULL;
+
+CREATE INDEX idx_claims_channel_claimed_at
+    ON claims (channel, claimed_at) INCLUDE (userid);
+
+-- No other partition exists yet, so this doesn't have to scan claims_default
+ALTER TABLE claims ATTACH PARTITION claims_default DEFAULT;
+
+-- Bookkeeping for the event partitions
+CREATE TABLE claims_partitions (
+    event INT NOT NULL,
+    name VARCHAR(63) NOT NULL,
+    starts_at TIMESTAMP NOT NULL,
+    ends_at TIMESTAMP NOT NULL,
+    anonymized_at TIMESTAMP,
+    PRIMARY KEY (event)
+);
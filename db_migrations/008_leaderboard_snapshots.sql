@@ -0,0 +1,15 @@
+-- One row per team per hourly leaderboard update, written in bulk with COPY.
+-- The primary key serves reading a whole snapshot (e.g. the previous hour's, for eco deltas),
+-- the team index serves a team's score history & trend over an event.
+CREATE TABLE IF NOT EXISTS leaderboard_snapshots (
+    event_id VARCHAR(64) NOT NULL,
+    taken_at TIMESTAMP NOT NULL,
+    team_id VARCHAR(64) NOT NULL,
+    score INT NOT NULL,
+    placement SMALLINT NOT NULL,
+    PRIMARY KEY (event_id, taken_at, team_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_leaderboard_snapshots_team
+    ON leaderboard_snapshots (event_id, team_id, taken_at)
+    INCLUDE (score, placement);
@@ -5,6 +5,7 @@ from datetime import datetime
 import bot.db.connection
 import bot.utils.bloonsdata
 from bot import __version__
+from bot.utils.EventBus import EventBus, Event
 from discord.ext import commands
 from config import TOKEN, APP_ID, DATA_PATH
 from bot.utils.colors import purple
@@ -25,6 +26,7 @@ class PandeHelper(commands.Bot):
         self.version = __version__
         self.last_restart = datetime.now()
         self.synced_tree = None
+        self.events = EventBus()
 
     async def setup_hook(self):
         await bot.utils.bloonsdata.init_bloonspy_client()
@@ -56,12 +58,8 @@ class PandeHelper(commands.Bot):
                     self.version = ln[len("__version__ = \""):-1]
                     return
 
-    async def signal(self, event: str, *args, **kwargs) -> None:
-        for cog_name in self.cogs:
-            cog = self.cogs[cog_name]
-            if hasattr(cog, event):
-                handler = getattr(cog, event)
-                await handler(*args, **kwargs)
+    async def signal(self, event: Event, *args, **kwargs) -> None:
+        await self.events.publish(event, *args, **kwargs)
 
 
 if __name__ == '__main__':
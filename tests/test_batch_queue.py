@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("config")
+from bot.db.BatchQueue import BatchQueue
+
+
+def make_queue(monkeypatch, execute):
+    queue = BatchQueue(delay=10)
+    BatchQueue.instances.remove(queue)
+    monkeypatch.setattr(BatchQueue, "_execute_batch", staticmethod(execute))
+    return queue
+
+
+def test_flush_for_only_flushes_matching_tags(monkeypatch):
+    async def run():
+        committed = []
+
+        async def execute(batch):
+            committed.extend(args for _q, args, _k, _t, _f in batch)
+
+        queue = make_queue(monkeypatch, execute)
+        write = asyncio.create_task(queue.put("q", 1, tags=(("message", 1),)))
+        await asyncio.sleep(0)
+
+        await queue.flush_for(("message", 2))
+        assert committed == []
+
+        await queue.flush_for(("message", 1))
+        assert committed == [(1,)]
+        await write
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_cancelled_flush_releases_writers(monkeypatch):
+    async def run():
+        started = asyncio.Event()
+
+        async def execute(_batch):
+            started.set()
+            await asyncio.sleep(10)
+
+        queue = make_queue(monkeypatch, execute)
+        write = asyncio.create_task(queue.put("q", 1))
+        await asyncio.sleep(0)
+        flush = asyncio.create_task(queue.flush())
+        await started.wait()
+        flush.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await write
+        assert queue._in_flight == []
+
+    asyncio.run(asyncio.wait_for(run(), 5))
@@ -0,0 +1,45 @@
+import asyncio
+import pytest
+from bot.utils.Debouncer import Debouncer
+
+
+def test_cancelled_run_releases_callers():
+    async def run():
+        calls = []
+
+        async def func(key):
+            calls.append(key)
+
+        debouncer = Debouncer(func, delay=0.05)
+        caller = asyncio.create_task(debouncer("a"))
+        await asyncio.sleep(0)
+        for task in list(debouncer._tasks):
+            task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        assert "a" not in debouncer._pending
+
+        await debouncer("a")
+        assert calls == ["a"]
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_cancelled_mid_run_releases_callers():
+    async def run():
+        started = asyncio.Event()
+
+        async def func(_key):
+            started.set()
+            await asyncio.sleep(10)
+
+        debouncer = Debouncer(func, delay=0)
+        caller = asyncio.create_task(debouncer("a"))
+        await started.wait()
+        for task in list(debouncer._tasks):
+            task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        assert "a" not in debouncer._pending
+
+    asyncio.run(asyncio.wait_for(run(), 5))
@@ -0,0 +1,53 @@
+import asyncio
+from bot.utils.EventBus import EventBus
+
+
+def test_slow_handler_is_not_cancelled():
+    async def run():
+        bus = EventBus(timeout=0.01)
+        finished = asyncio.Event()
+
+        async def slow():
+            await asyncio.sleep(0.05)
+            finished.set()
+
+        bus.subscribe("on_tile_started", slow)
+        await bus.publish("on_tile_started")
+        assert bus.stats["on_tile_started"].slow == 1
+        assert not finished.is_set()
+
+        await asyncio.wait_for(finished.wait(), 1)
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_handler_without_timeout_is_waited_for():
+    async def run():
+        bus = EventBus(timeout=0.01)
+        finished = asyncio.Event()
+
+        async def slow():
+            await asyncio.sleep(0.05)
+            finished.set()
+
+        bus.subscribe("on_tile_captured", slow, timeout=None)
+        await bus.publish("on_tile_captured")
+        assert finished.is_set()
+        assert bus.stats["on_tile_captured"].slow == 0
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_errors_are_counted():
+    async def run():
+        bus = EventBus()
+
+        async def failing():
+            raise ValueError("boom")
+
+        bus.subscribe("on_tile_uncaptured", failing)
+        await bus.publish("on_tile_uncaptured")
+        await asyncio.sleep(0)
+        assert bus.stats["on_tile_uncaptured"].errors == 1
+
+    asyncio.run(asyncio.wait_for(run(), 5))
@@ -0,0 +1,42 @@
+import asyncio
+import pytest
+
+discord = pytest.importorskip("discord")
+from bot.utils.MemberResolver import MemberResolver
+
+
+class FakeMember:
+    def __init__(self, uid: int):
+        self.id = uid
+        self.display_name = f"user{uid}"
+
+
+class FakeGuild:
+    def __init__(self, failing_chunk: int, error: Exception):
+        self.id = 1
+        self.failing_chunk = failing_chunk
+        self.error = error
+        self.queries = 0
+
+    def get_member(self, _uid: int):
+        return None
+
+    async def query_members(self, user_ids: list[int], limit: int, cache: bool):
+        chunk = self.queries
+        self.queries += 1
+        if chunk == self.failing_chunk:
+            raise self.error
+        return [FakeMember(uid) for uid in user_ids]
+
+
+@pytest.mark.parametrize("error", [asyncio.TimeoutError(), discord.ClientException("Intents.members is disabled")])
+def test_failed_chunk_is_left_out(error):
+    resolver = MemberResolver()
+    guild = FakeGuild(failing_chunk=0, error=error)
+    user_ids = list(range(MemberResolver.CHUNK_SIZE + 10))
+
+    members = asyncio.run(resolver.get_members(guild, user_ids))
+
+    assert guild.queries == 2
+    assert len(members) == 10
+    assert all(members[uid].id == uid for uid in members)
@@ -0,0 +1,26 @@
+from bot.utils.RecentMessageCache import CachedMessage, RecentMessageCache
+
+
+def test_clear_then_add_then_remove():
+    cache = RecentMessageCache()
+    message = cache.put(1, CachedMessage(10, 100, "AAA", {"✅": 2, "👍": 1}))
+
+    message.clear_reactions()
+    assert not message.has_reactions
+
+    message.add_reaction("✅")
+    assert cache.get(1, 10).reactions == {"✅": 1}
+    assert message.has_reactions
+
+    message.remove_reaction("✅")
+    assert not message.has_reactions
+
+
+def test_clear_single_emoji():
+    message = CachedMessage(10, 100, "AAA", {"✅": 2, "👍": 1})
+    message.clear_reactions("✅")
+    assert message.reactions == {"👍": 1}
+    assert message.has_reactions
+
+    message.remove_reaction("👍")
+    assert not message.has_reactions